@@ -1,6 +1,7 @@
+from functools import lru_cache
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from django.template.context import Context
+from django.contrib.contenttypes.models import ContentType
 from django.template.loader import get_template
 from django.utils.translation import ugettext_lazy as _
 from parler.admin import TranslatableAdmin, TranslatableInlineModelAdmin
@@ -138,6 +139,11 @@ class VideoAdmin(InvalidateProductCacheMixin, SearchProductIndexMixin, SortableA
     prepopulated_fields = {'slug': ['product_name']}
 
 
+@lru_cache(maxsize=None)
+def text_index_template():
+    return get_template('search/indexes/ssccms/commodity_text.txt')
+
+
 @admin.register(Album)
 class AlbumAdmin(InvalidateProductCacheMixin, SearchProductIndexMixin, SortableAdminMixin, TranslatableAdmin, FrontendEditableAdminMixin,
                       CMSPageAsCategoryMixin, PlaceholderAdminMixin, PolymorphicChildModelAdmin):
@@ -159,8 +165,7 @@ class AlbumAdmin(InvalidateProductCacheMixin, SearchProductIndexMixin, SortableA
     prepopulated_fields = {'slug': ['product_name']}
 
     def render_text_index(self, instance):
-        template = get_template('search/indexes/ssccms/commodity_text.txt')
-        return template.render(Context({'object': instance}))
+        return text_index_template().render({'object': instance})
     render_text_index.short_description = _("Text Index")
 
 
@@ -176,6 +181,16 @@ class ProductAdmin(PolymorphicSortableAdminMixin, PolymorphicParentModelAdmin):
     list_max_show_all = 1000
 
     def get_price(self, obj):
-        return str(obj.get_real_instance().get_price(None))
+        # every child model prices by unit_price, which lives on the base row,
+        # so there is no need to downcast each row with get_real_instance()
+        return str(obj.unit_price)
 
     get_price.short_description = _("Price starting at")
+    get_price.admin_order_field = 'unit_price'
+
+    def product_type(self, obj):
+        # same text as Product.product_type, but get_for_id() is served from
+        # the content type cache instead of following the FK on every row
+        return str(ContentType.objects.get_for_id(obj.polymorphic_ctype_id))
+
+    product_type.short_description = _("Product type")
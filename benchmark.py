@@ -0,0 +1,227 @@
+import os
+import csv
+import json
+import time
+import random
+import argparse
+import tempfile
+import tracemalloc
+import routes
+
+
+# 1. synthetic networks -> (nodes [(label, x, y)], edges [(node1, node2)])
+
+def grid_network(size):
+    # size x size grid, edges go right and up: C(2*size-2, size-1) routes
+    def label(i, j):
+        if (i, j) == (0, 0):
+            return "Source"
+        if (i, j) == (size - 1, size - 1):
+            return "Target"
+        return f"{i}_{j}"
+    nodes = [(label(i, j), i, j) for i in range(size) for j in range(size)]
+    edges = []
+    for i in range(size):
+        for j in range(size):
+            if i + 1 < size:
+                edges.append((label(i, j), label(i + 1, j)))
+            if j + 1 < size:
+                edges.append((label(i, j), label(i, j + 1)))
+    return nodes, edges
+
+
+def layered_network(layers, width, degree, rng):
+    # acyclic: every node links to `degree` random nodes of the next layer
+    nodes = [("Source", 0, 0)]
+    previous = ["Source"]
+    edges = []
+    for layer in range(1, layers + 1):
+        current = [f"{layer}_{i}" for i in range(width)]
+        nodes.extend((label, layer * 10, rng.randint(-width * 5, width * 5)) for label in current)
+        for node in previous:
+            for target in rng.sample(current, min(degree, width)):
+                edges.append((node, target))
+        previous = current
+    nodes.append(("Target", (layers + 1) * 10, 0))
+    edges.extend((node, "Target") for node in previous)
+    return nodes, edges
+
+
+def geometric_network(count, reach, rng):
+    # random points along a 100 x 10 strip, linked when closer than `reach`
+    # times the mean spacing; edges point towards larger x so the number of
+    # routes stays finite
+    spacing = 100 / (count + 1)
+    radius = reach * spacing
+    points = [(f"{i}", (i + 1 + rng.uniform(-0.4, 0.4)) * spacing, rng.uniform(45, 55)) for i in range(count)]
+    nodes = [("Source", 0, 50)] + points + [("Target", 100, 50)]
+    edges = []
+    for a in nodes:
+        for b in nodes:
+            if a[1] < b[1] and (a[1] - b[1]) ** 2 + (a[2] - b[2]) ** 2 <= radius ** 2:
+                edges.append((a[0], b[0]))
+    return nodes, edges
+
+
+def multiedge_network(layers, width, degree, multiplicity, rng):
+    # layered network with every edge repeated `multiplicity` times
+    nodes, edges = layered_network(layers, width, degree, rng)
+    return nodes, [edge for edge in edges for _ in range(multiplicity)]
+
+
+def write_network(nodes, edges, directory, name):
+    nodefile = os.path.join(directory, f"{name}_nodes.csv")
+    edgefile = os.path.join(directory, f"{name}_edges.csv")
+    with open(nodefile, 'w', encoding='UTF8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(["label", "x", "y"])
+        writer.writerows(nodes)
+    with open(edgefile, 'w', encoding='UTF8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(["node1", "node2"])
+        writer.writerows(edges)
+    return nodefile, edgefile
+
+
+def networks(scale, seed):
+    rng = random.Random(seed)
+    return {
+        "grid": grid_network(4 + 2 * scale),
+        "layered": layered_network(3 + 2 * scale, 4 + scale, 2, rng),
+        "geometric": geometric_network(6 + 6 * scale, 3, rng),
+        "multiedge": multiedge_network(2 + 2 * scale, 3 + scale, 2, 2, rng),
+    }
+
+
+# 2. measurements
+
+def measure(function, repeat=1):
+    # (result, best seconds of repeat runs, peak traced memory in bytes);
+    # memory is traced on the first run only, as tracing slows it down
+    tracemalloc.start()
+    result = function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    seconds = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        seconds = elapsed if seconds is None else min(seconds, elapsed)
+    return result, seconds, peak
+
+
+def count_rows(path):
+    with open(path, mode='r', encoding='UTF8', newline='') as f:
+        return sum(1 for _ in f) - 1
+
+
+def run_mode(multiDiGraph, nodedict, finalpath, mode, k, workers):
+    # one create_table run; k only applies to the modes that rank routes
+    stats = routes.Instrumentation()
+    routes.create_table(multiDiGraph, nodedict, finalpath, mode, k if mode in ("top", "ranked") else None, True,
+                        workers, stats=stats)
+    return stats
+
+
+def bench_network(nodefile, edgefile, directory, modes, k, workers, repeat):
+    (multiDiGraph, nodedict), seconds, peak = measure(lambda: routes.load_tables(nodefile, edgefile), repeat)
+    result = {
+        "nodes": multiDiGraph.number_of_nodes(),
+        "edges": multiDiGraph.number_of_edges(),
+        "load": {"seconds": seconds, "peak_bytes": peak},
+    }
+    finalpath = os.path.join(directory, "final.csv")
+    for mode in modes:
+        if mode == "summary" and not routes.is_acyclic(multiDiGraph):
+            continue
+        if mode == "ranked" and not routes.is_acyclic(multiDiGraph):
+            continue
+        stats, seconds, peak = measure(lambda: run_mode(multiDiGraph, nodedict, finalpath, mode, k, workers), repeat)
+        paths = stats.counters["counted_paths"] if mode == "summary" else count_rows(finalpath)
+        result[mode] = {
+            "seconds": seconds,
+            "peak_bytes": peak,
+            "paths": paths,
+            "paths_per_second": paths / seconds if seconds else None,
+            "write_seconds": stats.phases.get("write"),
+        }
+    if "stream" in result:
+        # stream writes while it enumerates; its write time is what it takes
+        # longer than enumerating alone
+        _, seconds, _ = measure(lambda: sum(1 for _ in routes.iter_paths(multiDiGraph, workers)), repeat)
+        result["stream"]["write_seconds"] = max(result["stream"]["seconds"] - seconds, 0.0)
+
+    # enumeration and writing of mode "all", timed apart
+    def enumerate_all():
+        store = routes.PathStore(multiDiGraph)
+        for lengthofpath, path in routes.iter_paths(multiDiGraph, workers):
+            store.append(lengthofpath, path)
+        return store
+    store, seconds, peak = measure(enumerate_all, repeat)
+
+    def write_all():
+        with open(finalpath, 'w', encoding='UTF8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(["length", "route"])
+            writer.writerows(store.rows())
+    _, writeseconds, _ = measure(write_all, repeat)
+    result["enumerate"] = {"seconds": seconds, "peak_bytes": peak, "paths": len(store),
+                           "paths_per_second": len(store) / seconds if seconds else None}
+    result["write"] = {"seconds": writeseconds}
+    return result
+
+
+def compare(results, baseline, tolerance, floor=0.01):
+    # lists every timing that got slower than baseline by more than
+    # tolerance; timings below floor seconds are too noisy to compare
+    regressions = []
+    for network, phases in results["networks"].items():
+        for phase, values in phases.items():
+            if not isinstance(values, dict) or "seconds" not in values:
+                continue
+            old = baseline.get("networks", {}).get(network, {}).get(phase, {}).get("seconds")
+            if old and max(old, values["seconds"]) >= floor and values["seconds"] > old * (1 + tolerance):
+                regressions.append(f'{network}/{phase}: {old:.4f}s -> {values["seconds"]:.4f}s')
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks for routes.py on synthetic networks.")
+    parser.add_argument("--scale", type=int, default=1, help="size of the generated networks")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--modes", default="summary,all,stream,top,ranked")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--repeat", type=int, default=3, help="runs per timing, the best one counts")
+    parser.add_argument("--output", default="bench_results.json", help="where to store the results")
+    parser.add_argument("--baseline", help="earlier results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown, 0.2 = 20%%")
+    parser.add_argument("--keep", help="directory to keep the generated networks in")
+    args = parser.parse_args(argv)
+
+    results = {"scale": args.scale, "seed": args.seed, "k": args.k, "workers": args.workers,
+               "repeat": args.repeat, "networks": {}}
+    with tempfile.TemporaryDirectory() as directory:
+        directory = args.keep or directory
+        os.makedirs(directory, exist_ok=True)
+        for name, (nodes, edges) in networks(args.scale, args.seed).items():
+            nodefile, edgefile = write_network(nodes, edges, directory, name)
+            results["networks"][name] = bench_network(
+                nodefile, edgefile, directory, args.modes.split(","), args.k, args.workers, args.repeat)
+            print(f'{name}: {json.dumps(results["networks"][name])}')
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f'Regression {regression}')
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
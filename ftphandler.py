@@ -1,39 +1,219 @@
-import mimetypes
-from pyftpdlib.handlers import FTPHandler
-from django.contrib.auth.models import User
-from filer.models.foldermodels import Folder
-from filer.models.imagemodels import Image
-from filer_app.models import FilerVideo, FilerSubtitles
+import hashlib
+import logging
+import queue
+import threading
+import time
+from pyftpdlib.handlers import FTPHandler, DTPHandler
+from django.db import close_old_connections
+from filer_app.models import FilerVideo
+from ssccms.ingest import FILER_TYPES, classify_file, owners, folders
+from ssccms.models import FileIngest
+from ssccms.hls import packaging_queue
+
+
+logger = logging.getLogger(__name__)
+
+
+def ingest_file(file, username, file_size, sha1=None):
+    file_location = file.split("\\")
+    file_name = file_location[-1]
+    location =  f"{file_location[-3]}/{file_location[-2]}/{file_name}"
+    mime_type, FilerClass, folder_name = classify_file(file_name)
+    owner = owners.get(username)
+    folder = folders.get(folder_name)
+
+    new_filer_object = FilerClass(
+        file=location
+        ,_file_size=file_size,
+        original_filename=file_name,
+        folder=folder,
+        owner=owner,
+        mime_type=mime_type
+        )
+    if sha1 is None:
+        new_filer_object.generate_sha1()
+    else:
+        new_filer_object.sha1 = sha1
+    new_filer_object.save()
+    return new_filer_object
+
+
+class IngestQueue:
+    # Hashes received files and creates their Filer objects on worker
+    # threads, so pyftpdlib's IO loop never waits for it. Failed jobs are
+    # retried with exponential backoff. The FileIngest table is the queue's
+    # durable state: start() picks up every file that was queued or
+    # interrupted by a restart. At most maxsize uploads and waiting files
+    # hold a place in the queue; uploads reserve theirs when STOR starts, so
+    # submit() never has to wait for one.
+    def __init__(self, workers=4, maxsize=64, max_attempts=3, backoff=2.0):
+        self.jobs = queue.Queue()
+        self.maxsize = maxsize
+        self.pending = 0
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.threads = []
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            if self.threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self.run, name=f"ftp-ingest-{i}", daemon=True)
+                thread.start()
+                self.threads.append(thread)
+            for record in FileIngest.objects.filter(status__in=['queued', 'running', 'retrying']).order_by('created_at'):
+                self.pending += 1
+                self.jobs.put_nowait((record, record.path, record.username, record.file_size, record.sha1 or None))
+
+    def reserve(self):
+        # a place for an upload that is about to start; False while full
+        with self.lock:
+            if self.pending >= self.maxsize:
+                return False
+            self.pending += 1
+            return True
+
+    def release(self):
+        with self.lock:
+            self.pending -= 1
+
+    def submit(self, file, username, file_size, sha1=None, reserved=False):
+        self.start()
+        if not reserved:
+            with self.lock:
+                self.pending += 1
+        # the record exists from the moment the file is received, with
+        # everything needed to resume it after a restart
+        try:
+            record = FileIngest.objects.create(path=file, username=username, file_size=file_size, sha1=sha1 or '',
+                                               status='queued')
+        except Exception:
+            logger.exception("Could not record the ingest of %s", file)
+            record = None
+        self.jobs.put_nowait((record, file, username, file_size, sha1))
+
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            self.release()
+            try:
+                self.ingest(*job)
+            except Exception:
+                # a failing job must not take its worker thread with it
+                logger.exception("Ingest of %s failed", job[1])
+            finally:
+                self.jobs.task_done()
+                close_old_connections()
+
+    def ingest(self, record, file, username, file_size, sha1=None):
+        if record is None:
+            record = FileIngest.objects.create(path=file, username=username, file_size=file_size, sha1=sha1 or '')
+        record.status = 'running'
+        record.save()
+        while True:
+            record.attempts += 1
+            try:
+                record.file = ingest_file(file, username, file_size, sha1)
+            except Exception as e:
+                logger.exception("Ingest of %s failed (attempt %d)", file, record.attempts)
+                record.error = repr(e)
+                if record.attempts >= self.max_attempts:
+                    record.status = 'failed'
+                    record.save()
+                    return
+                record.status = 'retrying'
+                record.save()
+                close_old_connections()
+                time.sleep(self.backoff ** record.attempts)
+            else:
+                record.status = 'done'
+                record.error = ''
+                record.save()
+                if isinstance(record.file, FilerVideo):
+                    packaging_queue.submit(record.file)
+                return
+
+
+class HashingFile:
+    # Wraps the file an upload is written to and feeds every chunk into a
+    # SHA1, so the digest is ready when the upload ends.
+    def __init__(self, file_obj):
+        self.file_obj = file_obj
+        self.sha1 = hashlib.sha1()
+
+    def write(self, data):
+        self.sha1.update(data)
+        return self.file_obj.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.file_obj, name)
+
+
+class HashingDTPHandler(DTPHandler):
+    def enable_receiving(self, type, cmd):
+        # resumed uploads (APPE, REST) only pass the tail of the file
+        if cmd == "STOR" and self.file_obj.tell() == 0:
+            self.file_obj = HashingFile(self.file_obj)
+        super().enable_receiving(type, cmd)
 
 
 class FileHandler(FTPHandler):
+    dtp_handler = HashingDTPHandler
+    ingest_queue = IngestQueue()
+    # whether this session holds a place in the ingest queue
+    ingest_reserved = False
+
+    def on_connect(self):
+        # resume ingest and packaging jobs that were waiting when the server
+        # stopped
+        self.ingest_queue.start()
+        packaging_queue.start()
+
+    def on_login(self, username):
+        # warm the lookups once per session, not per received file
+        try:
+            owners.get(username)
+            for FilerClass, folder_name in FILER_TYPES.values():
+                folders.get(folder_name)
+        except IndexError:
+            logger.warning("Missing owner or upload folder for %s", username)
+
+    def release_ingest(self):
+        if self.ingest_reserved:
+            self.ingest_reserved = False
+            self.ingest_queue.release()
+
+    def ftp_STOR(self, file, mode='w'):
+        # the place is held until the upload ends; one left by an upload that
+        # never started (ABOR, REIN) is reused
+        if not self.ingest_reserved:
+            if not self.ingest_queue.reserve():
+                # the next STOR must not resume at this one's REST offset
+                self._restart_position = 0
+                self.respond("450 Too many files waiting to be processed, try again later.")
+                return
+            self.ingest_reserved = True
+        result = super().ftp_STOR(file, mode)
+        if result is None:
+            self.release_ingest()
+        return result
+
     def on_file_received(self, file):
-        file_location = file.split("\\")
-        file_name = file_location[-1]
-        location =  f"{file_location[-3]}/{file_location[-2]}/{file_name}"
-        mime_type_as_tuple = mimetypes.guess_type(file_name)
-        mime_type = mime_type_as_tuple[0] 
-        file_type = mime_type.split("/")[-2]
-        owner = User.objects.filter(username=self.get_repr_info().__getitem__("user"))[0]
+        username = self.get_repr_info().__getitem__("user")
         file_size = self.get_repr_info().__getitem__("bytes-trans")
+        file_obj = getattr(self.data_channel, "file_obj", None)
+        sha1 = file_obj.sha1.hexdigest() if isinstance(file_obj, HashingFile) else None
+        # the job takes over the place of the upload (STOU uploads have none)
+        reserved = self.ingest_reserved
+        self.ingest_reserved = False
+        self.ingest_queue.submit(file, username, file_size, sha1, reserved)
 
-        if file_type == "video":
-            FilerClass = FilerVideo
-            folder = Folder.objects.filter(name="videos")[0]
-        elif file_type == "image":
-            FilerClass = Image
-            folder = Folder.objects.filter(name="images")[0]
-        elif file_type == "text":
-            FilerClass = FilerSubtitles
-            folder = Folder.objects.filter(name="subtitles")[0]
-
-        new_filer_object = FilerClass(
-            file=location
-            ,_file_size=file_size,
-            original_filename=file_name,
-            folder=folder,
-            owner=owner,
-            mime_type=mime_type
-            )
-        new_filer_object.generate_sha1()
-        new_filer_object.save()
+    def on_incomplete_file_received(self, file):
+        self.release_ingest()
+
+    def close(self):
+        super().close()
+        self.release_ingest()
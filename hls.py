@@ -0,0 +1,137 @@
+import os
+import queue
+import shutil
+import logging
+import subprocess
+import threading
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import F
+from ssccms.models import StreamJob, ProductVideo, product_snapshots, stream_paths
+
+logger = logging.getLogger(__name__)
+
+
+# (name, height, video bitrate, audio bitrate) of the HLS renditions
+RENDITIONS = getattr(settings, 'HLS_RENDITIONS', [
+    ("1080p", 1080, "5000k", "192k"),
+    ("720p", 720, "2800k", "128k"),
+    ("480p", 480, "1400k", "96k"),
+])
+SEGMENT_SECONDS = getattr(settings, 'HLS_SEGMENT_SECONDS', 6)
+
+
+def has_audio(source):
+    result = subprocess.run(
+        ["ffprobe", "-v", "error", "-select_streams", "a", "-show_entries", "stream=index", "-of", "csv=p=0", source],
+        capture_output=True, text=True, check=True,
+    )
+    return bool(result.stdout.strip())
+
+
+def ffmpeg_command(source, target, name, audio=True):
+    # one ffmpeg run scales the video into every rendition and writes
+    # <target>/<rendition>/index.m3u8 plus the master playlist <name>.m3u8
+    split = f"[0:v]split={len(RENDITIONS)}" + "".join(f"[v{i}]" for i in range(len(RENDITIONS)))
+    scales = [f"[v{i}]scale=-2:{height}[v{i}out]" for i, (_, height, _, _) in enumerate(RENDITIONS)]
+    command = ["ffmpeg", "-y", "-v", "error", "-i", source, "-filter_complex", ";".join([split] + scales)]
+    streams = []
+    for i, (rendition, height, video_rate, audio_rate) in enumerate(RENDITIONS):
+        command += ["-map", f"[v{i}out]", f"-c:v:{i}", "libx264", f"-b:v:{i}", video_rate]
+        if audio:
+            command += ["-map", "0:a:0", f"-c:a:{i}", "aac", f"-b:a:{i}", audio_rate]
+            streams.append(f"v:{i},a:{i},name:{rendition}")
+        else:
+            streams.append(f"v:{i},name:{rendition}")
+    command += [
+        "-f", "hls",
+        "-hls_time", str(SEGMENT_SECONDS),
+        "-hls_playlist_type", "vod",
+        "-hls_segment_filename", os.path.join(target, "%v", "segment_%05d.ts"),
+        "-master_pl_name", f"{name}.m3u8",
+        "-var_stream_map", " ".join(streams),
+        os.path.join(target, "%v", "index.m3u8"),
+    ]
+    return command
+
+
+def package(source, filename):
+    # ffmpeg writes into a scratch directory that only replaces the stream
+    # directory once it is complete, so a half-written stream is never served
+    playlist = stream_paths(filename)[1]
+    target = os.path.dirname(playlist)
+    scratch = target + ".partial"
+    shutil.rmtree(scratch, ignore_errors=True)
+    os.makedirs(scratch)
+    subprocess.run(ffmpeg_command(source, scratch, os.path.basename(target), has_audio(source)),
+                   capture_output=True, text=True, check=True)
+    shutil.rmtree(target, ignore_errors=True)
+    os.replace(scratch, target)
+
+
+class PackagingQueue:
+    # Segments videos into HLS renditions with local ffmpeg processes, one
+    # per worker thread. The StreamJob table is the queue's durable state:
+    # start() picks up every job that was queued or interrupted by a restart.
+    def __init__(self, workers=2, max_attempts=2):
+        self.jobs = queue.Queue()
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.threads = []
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            if self.threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self.run, name=f"hls-packaging-{i}", daemon=True)
+                thread.start()
+                self.threads.append(thread)
+            StreamJob.objects.filter(status='running').update(status='queued')
+            for pk in StreamJob.objects.filter(status='queued').order_by('created_at').values_list('pk', flat=True):
+                self.jobs.put(pk)
+
+    def submit(self, video):
+        job, created = StreamJob.objects.get_or_create(video=video)
+        self.start()
+        if created:
+            # start() may have queued it as well, package() runs it only once
+            self.jobs.put(job.pk)
+        return job
+
+    def run(self):
+        while True:
+            pk = self.jobs.get()
+            try:
+                self.package(pk)
+            except Exception:
+                logger.exception("Packaging job %s failed", pk)
+            finally:
+                self.jobs.task_done()
+                close_old_connections()
+
+    def package(self, pk):
+        # claim the job atomically, it may be on the queue more than once
+        if not StreamJob.objects.filter(pk=pk, status='queued').update(status='running', attempts=F('attempts') + 1):
+            return
+        job = StreamJob.objects.select_related('video').get(pk=pk)
+        try:
+            package(job.video.file.path, job.video.original_filename)
+        except Exception as e:
+            error = e.stderr if isinstance(e, subprocess.CalledProcessError) else repr(e)
+            logger.error("Packaging %s failed (attempt %d): %s", job.video, job.attempts, error)
+            job.error = error or repr(e)
+            job.status = 'queued' if job.attempts < self.max_attempts else 'failed'
+            job.save()
+            if job.status == 'queued':
+                self.jobs.put(pk)
+        else:
+            job.status = 'done'
+            job.error = ''
+            job.save()
+            # cached snapshots still say the video has no stream
+            product_snapshots.invalidate(*ProductVideo.objects.filter(video=job.video).values_list('product_id', flat=True))
+
+
+packaging_queue = PackagingQueue(getattr(settings, 'HLS_WORKERS', 2))
@@ -0,0 +1,84 @@
+import os
+import mimetypes
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from django.contrib.auth.models import User
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from filer.models.foldermodels import Folder
+from filer.models.imagemodels import Image
+from filer_app.models import FilerVideo, FilerSubtitles
+
+
+# shared by the FTP handler and the backfill command
+
+
+# file type (first part of the MIME type) -> Filer class, folder name
+FILER_TYPES = {
+    "video": (FilerVideo, "videos"),
+    "image": (Image, "images"),
+    "text": (FilerSubtitles, "subtitles"),
+}
+
+
+@lru_cache(maxsize=1024)
+def classify(file_name):
+    # -> (mime type, Filer class, folder name); classify_file() only passes
+    # the lower-cased extension so the cache is keyed per file type
+    mime_type = mimetypes.guess_type(file_name)[0]
+    file_type = mime_type.split("/")[-2]
+    FilerClass, folder_name = FILER_TYPES[file_type]
+    return mime_type, FilerClass, folder_name
+
+
+def classify_file(file_name):
+    return classify("file" + os.path.splitext(file_name)[1].lower())
+
+
+class LookupCache:
+    # Small thread-safe LRU cache whose entries expire after ttl seconds.
+    def __init__(self, loader, maxsize=256, ttl=300):
+        self.loader = loader
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > now:
+                self.entries.move_to_end(key)
+                return entry[1]
+        value = self.loader(key)
+        with self.lock:
+            self.entries[key] = (now + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        return value
+
+    def invalidate(self, key=None):
+        with self.lock:
+            if key is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(key, None)
+
+
+owners = LookupCache(lambda username: User.objects.filter(username=username)[0])
+folders = LookupCache(lambda name: Folder.objects.filter(name=name)[0])
+
+
+@receiver([post_save, post_delete], sender=User)
+def invalidate_owner(sender, instance, **kwargs):
+    # the username may just have changed, so the old key is unknown
+    owners.invalidate()
+
+
+@receiver([post_save, post_delete], sender=Folder)
+def invalidate_folder(sender, instance, **kwargs):
+    folders.invalidate()
@@ -0,0 +1,154 @@
+import os
+import time
+import hashlib
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from filer.models.imagemodels import Image
+from filer.models.filemodels import File
+from ssccms.ingest import classify_file, owners, folders
+
+
+# management command: manage.py backfill <directory> --owner <username>
+
+
+def hash_file(path):
+    # runs in a worker process
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha1.update(chunk)
+    return path, os.path.getsize(path), sha1.hexdigest()
+
+
+def walk(directory):
+    # -> (path, mime type, Filer class, folder name) for every file the
+    # FTP ingest path would accept, in a stable order
+    for base, dirs, names in os.walk(directory):
+        dirs.sort()
+        for name in sorted(names):
+            try:
+                yield (os.path.join(base, name),) + classify_file(name)
+            except (AttributeError, KeyError):
+                yield os.path.join(base, name), None, None, None
+
+
+def insert_files(FilerClass, files):
+    # bulk_create refuses multi-table inherited models, so the File rows are
+    # created first and the subclass rows are inserted against their pks.
+    # Image.save() reads the image dimensions, so images are saved one by
+    # one like the FTP ingest does; the others get what File.save() would
+    # compute before they are inserted.
+    if issubclass(FilerClass, Image):
+        for file in files:
+            file.save()
+        return files
+    ctype = ContentType.objects.get_for_model(FilerClass, for_concrete_model=False)
+    parents = []
+    for file in files:
+        file.polymorphic_ctype = ctype
+        file.has_all_mandatory_data = file._check_validity()
+        parents.append(File(**{field.attname: getattr(file, field.attname) for field in File._meta.concrete_fields}))
+    File.objects.bulk_create(parents)
+    for model in list(reversed(FilerClass._meta.get_parent_list())) + [FilerClass]:
+        if model is File or model._meta.abstract:
+            continue
+        for file, parent in zip(files, parents):
+            setattr(file, model._meta.pk.attname, parent.pk)
+        model._base_manager._insert(files, fields=model._meta.local_concrete_fields)
+    for file, parent in zip(files, parents):
+        file.pk = parent.pk
+        file._state.adding = False
+    return files
+
+
+class Command(BaseCommand):
+    help = "Import an existing directory tree of videos, images and subtitles into Filer."
+
+    def add_arguments(self, parser):
+        parser.add_argument("directory")
+        parser.add_argument("--owner", required=True, help="username the files belong to")
+        parser.add_argument("--root", help="storage root the stored paths are relative to (default: the Filer storage location)")
+        parser.add_argument("--workers", type=int, default=None, help="hashing processes (default: one per CPU)")
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        directory = options["directory"]
+        if not os.path.isdir(directory):
+            raise CommandError(f"{directory} is not a directory")
+        root = options["root"] or File._meta.get_field("file").storage.location
+        if os.path.relpath(os.path.abspath(directory), os.path.abspath(root)).startswith(os.pardir):
+            raise CommandError(f"{directory} is not inside the storage root {root}")
+        try:
+            owner = owners.get(options["owner"])
+        except IndexError:
+            raise CommandError(f"Unknown user {options['owner']}")
+
+        # 1. Hash the files the ingest mapping knows about in a process pool;
+        # only a window of files is submitted at a time, so memory stays flat
+        # on large trees
+        self.seen = set()
+        self.created = self.skipped = self.size = 0
+        unsupported = 0
+        start = time.perf_counter()
+        batch = []
+        pending = deque()
+        workers = options["workers"] or os.cpu_count()
+        with ProcessPoolExecutor(workers) as pool:
+            for path, mime_type, FilerClass, folder_name in walk(directory):
+                if FilerClass is None:
+                    unsupported += 1
+                    continue
+                pending.append((pool.submit(hash_file, path), (mime_type, FilerClass, folder_name)))
+                while len(pending) > 4 * workers or (pending and pending[0][0].done()):
+                    future, classification = pending.popleft()
+                    batch.append(future.result() + classification)
+
+                    # 2. Insert whatever is new in batches
+                    if len(batch) >= options["batch_size"]:
+                        self.flush(batch, root, owner)
+                        batch = []
+                        self.report(start, options, level=2)
+            for future, classification in pending:
+                batch.append(future.result() + classification)
+            self.flush(batch, root, owner)
+
+        # 3. Report throughput
+        self.report(start, options)
+        self.stdout.write(f"Skipped {self.skipped} existing and {unsupported} unsupported files")
+
+    def flush(self, batch, root, owner):
+        # files whose sha1 is already in Filer were imported by an earlier
+        # (possibly interrupted) run or by the FTP handler, so skip them
+        existing = set(File.objects.filter(sha1__in={row[2] for row in batch}).values_list("sha1", flat=True))
+        groups = defaultdict(list)
+        for path, file_size, sha1, mime_type, FilerClass, folder_name in batch:
+            if sha1 in existing or sha1 in self.seen:
+                self.skipped += 1
+                continue
+            self.seen.add(sha1)
+            file_name = os.path.basename(path)
+            groups[FilerClass].append(FilerClass(
+                file=os.path.relpath(path, root).replace(os.sep, "/"),
+                _file_size=file_size,
+                sha1=sha1,
+                original_filename=file_name,
+                folder=folders.get(folder_name),
+                owner=owner,
+                mime_type=mime_type,
+            ))
+            self.size += file_size
+        with transaction.atomic():
+            for FilerClass, files in groups.items():
+                self.created += len(insert_files(FilerClass, files))
+
+    def report(self, start, options, level=1):
+        if options["verbosity"] < level:
+            return
+        elapsed = max(time.perf_counter() - start, 1e-9)
+        self.stdout.write(
+            f"Imported {self.created} files ({self.size / 1e6:.1f} MB) in {elapsed:.1f}s: "
+            f"{self.created / elapsed:.1f} files/s, {self.size / 1e6 / elapsed:.1f} MB/s"
+        )
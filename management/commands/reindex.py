@@ -0,0 +1,161 @@
+import json
+import os
+import time
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.template.loader import select_template
+from django.utils import timezone, translation
+from django_elasticsearch_dsl.registries import registry
+from elasticsearch.helpers import bulk, scan
+from elasticsearch_dsl.connections import get_connection
+from ssccms.models import Product, Commodity, Video, Album
+
+
+# management command: manage.py reindex [--incremental]
+
+# product model name -> compiled search template, and language -> Document
+# instance; both are filled in before the worker processes are forked, so
+# each template is only loaded once
+templates = {}
+documents = {}
+
+
+def load_templates():
+    for model in (Commodity, Video, Album):
+        app_label = model._meta.app_label.lower()
+        params = [(app_label, model._meta.model_name), (app_label, 'product'), ('shop', 'product')]
+        templates[model._meta.model_name] = select_template(['{0}/search/indexes/{1}.txt'.format(*p) for p in params])
+
+
+def load_documents():
+    # mirrors Product.update_search_index()
+    docs = registry.get_documents([Product])
+    if not settings.USE_I18N:
+        documents[settings.LANGUAGE_CODE] = next(iter(docs))()
+        return
+    default = next((doc for doc in docs if doc._language is None), None)
+    for language, _ in settings.LANGUAGES:
+        documents[language] = next((doc for doc in docs if doc._language == language), default)()
+
+
+def prepare(document, product):
+    # Document.prepare(), with the body rendered from the preloaded template
+    # instead of looking the template up again for every product
+    source = {}
+    for name, field, prep_func in document._prepared_fields:
+        if name == 'body':
+            source[name] = templates[product._meta.model_name].render({'product': product})
+        else:
+            source[name] = prep_func(product)
+    return source
+
+
+def render_chunk(products):
+    # runs in a worker process: -> {language: [(id, source), ...]}
+    sources = {}
+    for language, document in documents.items():
+        with translation.override(language):
+            sources[language] = []
+            for product in products:
+                product.set_current_language(language)
+                sources[language].append((document.generate_id(product), prepare(document, product)))
+    return sources
+
+
+class Command(BaseCommand):
+    help = "Rebuild the product search index in bulk."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--incremental", action="store_true", help="only products changed since the last run")
+        parser.add_argument("--state", default="search_reindex.json", help="file remembering the last run")
+        parser.add_argument("--chunk-size", type=int, default=200)
+        parser.add_argument("--workers", type=int, default=None, help="rendering processes (default: one per CPU)")
+
+    def handle(self, *args, **options):
+        # 1. Select the products to index
+        started = timezone.now()
+        products = Product.objects.order_by('pk')
+        if options["incremental"]:
+            try:
+                with open(options["state"]) as f:
+                    since = json.load(f)["last_run"]
+            except FileNotFoundError:
+                raise CommandError(f"No previous run recorded in {options['state']}, run a full reindex first")
+            # catchphrase and media changes touch updated_at as well
+            products = products.filter(updated_at__gte=since)
+        pks = list(products.values_list('pk', flat=True))
+        chunks = [pks[i:i + options["chunk_size"]] for i in range(0, len(pks), options["chunk_size"])]
+
+        # 2. Render in a process pool, fetching chunks while earlier ones render
+        load_documents()
+        load_templates()
+        workers = options["workers"] or os.cpu_count()
+        start = time.perf_counter()
+        self.sent = self.deleted = 0
+        self.errors = []
+        pending = deque()
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("fork")) as pool:
+            # fork the workers before this process opens a database connection
+            # they could inherit
+            connections.close_all()
+            pool.submit(int).result()
+            for chunk in chunks:
+                items = list(Product.objects.filter(pk__in=chunk).select_related('polymorphic_ctype')
+                             .with_media_paths().with_catchphrases())
+                active = [product for product in items if product.active]
+                pending.append((items, pool.submit(render_chunk, active)))
+                if len(pending) > 2 * workers:
+                    self.send(*pending.popleft())
+            while pending:
+                self.send(*pending.popleft())
+
+        # 4. Drop documents of products that no longer exist
+        self.remove_deleted()
+
+        if self.errors:
+            raise CommandError(f"{len(self.errors)} documents failed, first error: {self.errors[0]}")
+        with open(options["state"], "w") as f:
+            json.dump({"last_run": started.isoformat()}, f)
+        elapsed = max(time.perf_counter() - start, 1e-9)
+        self.stdout.write(
+            f"Sent {self.sent} documents in {elapsed:.1f}s ({self.sent / elapsed:.1f} documents/s), "
+            f"{self.deleted} inactive or deleted products removed"
+        )
+
+    def send(self, items, future):
+        # 3. Send a rendered chunk to the search backend in one bulk request
+        sources = future.result()
+        inactive = [product for product in items if not product.active]
+        actions = []
+        for language, document in documents.items():
+            index = document._index._name
+            for product in inactive:
+                actions.append({'_op_type': 'delete', '_index': index, '_id': document.generate_id(product)})
+            for id, source in sources[language]:
+                actions.append({'_op_type': 'index', '_index': index, '_id': id, '_source': source})
+        self.deleted += len(inactive)
+        self.bulk(actions)
+
+    def remove_deleted(self):
+        # the ids in the index are product pks (Document.generate_id)
+        existing = {str(pk) for pk in Product.objects.values_list('pk', flat=True)}
+        client = get_connection()
+        actions = []
+        deleted = set()
+        for index in {document._index._name for document in documents.values()}:
+            for hit in scan(client, index=index, query={"query": {"match_all": {}}}, _source=False):
+                if hit['_id'] not in existing:
+                    actions.append({'_op_type': 'delete', '_index': index, '_id': hit['_id']})
+                    deleted.add(hit['_id'])
+        self.deleted += len(deleted)
+        self.bulk(actions)
+
+    def bulk(self, actions):
+        done, failed = bulk(get_connection(), actions, raise_on_error=False)
+        self.sent += done
+        # deleting a product that was never indexed is not an error
+        self.errors += [e for e in failed if e.get('delete', {}).get('status') != 404]
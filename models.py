@@ -1,9 +1,16 @@
+import os
 from decimal import Decimal
 from django.contrib.auth.models import PermissionsMixin
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.validators import MinValueValidator
-from django.db import models
-from django.utils.translation import ugettext_lazy as _
+from django.conf import settings as django_settings
+from django.core.cache import caches
+from django.db import models, transaction
+from django.db.models import OuterRef, Subquery
+from django.db.models.signals import m2m_changed, post_save, pre_delete, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.translation import ugettext_lazy as _, get_language
 from djangocms_text_ckeditor.fields import HTMLField
 from polymorphic.query import PolymorphicQuerySet
 from parler.managers import TranslatableManager, TranslatableQuerySet
@@ -39,6 +46,44 @@ class CustomerImage(BaseCustomerImage):
         abstract = False
 
 
+class Sequence(models.Model):
+    # one row per named counter; next_value() locks the row, so concurrent
+    # callers are served one after another without scanning any table
+    name = models.CharField(
+        _("Name"),
+        max_length=50,
+        primary_key=True,
+    )
+
+    value = models.BigIntegerField(
+        _("Last value"),
+        default=0,
+    )
+
+    class Meta:
+        verbose_name = _("Sequence")
+        verbose_name_plural = _("Sequences")
+
+    def __str__(self):
+        return self.name
+
+    @classmethod
+    def next_value(cls, name, seed=None):
+        # seed is called once, when the counter row does not exist yet, and
+        # returns the value to continue from
+        with transaction.atomic():
+            defaults = {'value': seed} if seed else {}
+            counter = cls.objects.select_for_update().get_or_create(name=name, defaults=defaults)[0]
+            counter.value += 1
+            counter.save(update_fields=['value'])
+            return counter.value
+
+
+def max_customer_number():
+    aggr = Customer.objects.filter(number__isnull=False).aggregate(models.Max('number'))
+    return aggr['number__max'] or 0
+
+
 class Customer(BaseCustomer):
     SALUTATION = [('mrs', _("Mrs.")), ('mr', _("Mr.")), ('na', _("(n/a)"))]
 
@@ -97,9 +142,9 @@ class Customer(BaseCustomer):
 
     def get_or_assign_number(self):
         if self.number is None:
-            aggr = Customer.objects.filter(number__isnull=False).aggregate(models.Max('number'))
-            self.number = (aggr['number__max'] or 0) + 1
-            self.save()
+            with transaction.atomic():
+                self.number = Sequence.next_value('customer_number', seed=max_customer_number)
+                self.save()
         return self.get_number()
 
     def as_text(self):
@@ -126,6 +171,128 @@ class OrderItem(BaseOrderItem):
             raise CartItem.DoesNotExist(e)
 
 
+class FileIngest(models.Model):
+    STATUS = [
+        ('queued', _("Queued")),
+        ('running', _("Running")),
+        ('retrying', _("Retrying")),
+        ('done', _("Done")),
+        ('failed', _("Failed")),
+    ]
+
+    path = models.CharField(
+        _("Path"),
+        max_length=255,
+    )
+
+    # what the ingest queue needs to resume the file after a restart
+    username = models.CharField(
+        _("Username"),
+        max_length=150,
+        blank=True,
+    )
+
+    file_size = models.BigIntegerField(
+        _("File size"),
+        null=True,
+        blank=True,
+    )
+
+    sha1 = models.CharField(
+        _("SHA1"),
+        max_length=40,
+        blank=True,
+    )
+
+    status = models.CharField(
+        _("Status"),
+        max_length=10,
+        choices=STATUS,
+        default='running',
+        db_index=True,
+    )
+
+    attempts = models.PositiveIntegerField(
+        _("Attempts"),
+        default=0,
+    )
+
+    error = models.TextField(
+        _("Last error"),
+        blank=True,
+    )
+
+    file = models.ForeignKey(
+        'filer.File',
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name='+',
+    )
+
+    created_at = models.DateTimeField(_("Created at"), auto_now_add=True)
+    updated_at = models.DateTimeField(_("Updated at"), auto_now=True)
+
+    class Meta:
+        verbose_name = _("File ingest")
+        verbose_name_plural = _("File ingests")
+
+    def __str__(self):
+        return self.path
+
+
+class StreamJob(models.Model):
+    STATUS = [
+        ('queued', _("Queued")),
+        ('running', _("Running")),
+        ('done', _("Done")),
+        ('failed', _("Failed")),
+    ]
+
+    video = models.OneToOneField(
+        FilerVideo,
+        on_delete=models.CASCADE,
+        related_name='stream_job',
+    )
+
+    status = models.CharField(
+        _("Status"),
+        max_length=10,
+        choices=STATUS,
+        default='queued',
+        db_index=True,
+    )
+
+    attempts = models.PositiveIntegerField(
+        _("Attempts"),
+        default=0,
+    )
+
+    error = models.TextField(
+        _("Last error"),
+        blank=True,
+    )
+
+    created_at = models.DateTimeField(_("Created at"), auto_now_add=True)
+    updated_at = models.DateTimeField(_("Updated at"), auto_now=True)
+
+    class Meta:
+        verbose_name = _("Stream job")
+        verbose_name_plural = _("Stream jobs")
+
+    def __str__(self):
+        return str(self.video)
+
+
+def stream_paths(filename):
+    # -> (URL, file system path) of the HLS master playlist of a video file
+    name = filename[:filename.rfind('.')]
+    return (
+        f"/media/filer_public_streams/{name}/{name}.m3u8",
+        os.path.join(django_settings.MEDIA_ROOT, "filer_public_streams", name, f"{name}.m3u8"),
+    )
+
+
 class Catchphrase(models.Model):
     name = models.CharField(
         _("Name"),
@@ -142,7 +309,21 @@ class Catchphrase(models.Model):
 
 
 class ProductQuerySet(TranslatableQuerySet, PolymorphicQuerySet):
-    pass
+    def with_media_paths(self):
+        # resolve the first video, subtitles and image file of every product
+        # in the page query itself instead of two queries per product and path
+        def first(through, field):
+            rows = through.objects.filter(product_id=OuterRef('pk')).values(field)
+            return Subquery(rows[:1])
+
+        return self.annotate(
+            videofile_name=first(ProductVideo, 'video__original_filename'),
+            subtitles_file=first(ProductSubtitles, 'subtitles__file'),
+            image_file=first(ProductImage, 'image__file'),
+        )
+
+    def with_catchphrases(self):
+        return self.prefetch_related('catchphrases')
 
 class ProductManager(BaseProductManager, TranslatableManager):
     queryset_class = ProductQuerySet
@@ -151,6 +332,14 @@ class ProductManager(BaseProductManager, TranslatableManager):
         qs = self.queryset_class(self.model, using=self._db)
         return qs.prefetch_related('translations')
 
+    # the manager is not built with from_queryset(), so the queryset
+    # helpers are forwarded by hand
+    def with_media_paths(self):
+        return self.get_queryset().with_media_paths()
+
+    def with_catchphrases(self):
+        return self.get_queryset().with_catchphrases()
+
 
 # Materialize many-to-many relation with Django-Filer custom models from filer_app / ssccms.related
 class ProductSubtitles(BaseProductSubtitles):
@@ -207,6 +396,14 @@ class Product(CMSPageReferenceMixin, TranslatableModelMixin, BaseProduct):
         verbose_name=_("Kategory")
     )
 
+    # denormalized catchphrases_as_string(), kept current by the m2m_changed
+    # handler below; NULL until the first refresh
+    catchphrases_cache = models.TextField(
+        null=True,
+        blank=True,
+        editable=False,
+    )
+
     # controlling the catalog
     order = models.PositiveIntegerField(
         _("Sort by"),
@@ -239,31 +436,58 @@ class Product(CMSPageReferenceMixin, TranslatableModelMixin, BaseProduct):
         return self.product_name
 
     def get_videofile_path(self):
-        try:
-            filename = File.objects.filter(id=(ProductVideo.objects.filter(product_id=self.id).values('video_id')[0]['video_id'])).values('original_filename')[0]['original_filename']
-            name = filename[:filename.rfind('.')]
-            return f"/media/filer_public_streams/{name}/{name}.m3u8"
-        except:
-            pass
+        # None until the HLS packaging of the video has finished
+        if 'videofile_name' in self.__dict__:
+            filename = self.videofile_name
+            if filename is None:
+                return None
+        else:
+            try:
+                filename = File.objects.filter(id=(ProductVideo.objects.filter(product_id=self.id).values('video_id')[0]['video_id'])).values('original_filename')[0]['original_filename']
+            except:
+                return None
+        url, path = stream_paths(filename)
+        if os.path.exists(path):
+            return url
+
+    def get_videofile_status(self):
+        # 'queued', 'running', 'done' or 'failed', None for videos that were
+        # never handed to the packaging queue
+        video_id = ProductVideo.objects.filter(product_id=self.id).values('video_id')[:1]
+        return StreamJob.objects.filter(video_id__in=video_id).values_list('status', flat=True).first()
 
     def get_subtitles_path(self):
+        if 'subtitles_file' in self.__dict__:
+            return self.subtitles_file
         try:
             return File.objects.filter(id=(ProductSubtitles.objects.filter(product_id=self.id).values('subtitles_id')[0]['subtitles_id'])).values('file')[0]['file']
         except:
             pass
 
     def get_image_path(self):
+        if 'image_file' in self.__dict__:
+            return self.image_file
         try:
             return File.objects.filter(id=(ProductImage.objects.filter(product_id=self.id).values('image_id')[0]['image_id'])).values('file')[0]['file']
         except:
             pass
 
     def catchphrases_as_string(self):
-        catchphrase_list = list(self.catchphrases.all().values_list('name'))
-        catchphrase_as_string = ""
-        for e in catchphrase_list:
-            catchphrase_as_string = catchphrase_as_string + ''.join(e) + " "
-        return catchphrase_as_string
+        # a prefetch (see ProductQuerySet.with_catchphrases) wins over the
+        # denormalized value, which wins over a query
+        if 'catchphrases' in getattr(self, '_prefetched_objects_cache', {}):
+            names = [c.name for c in self.catchphrases.all()]
+        elif self.catchphrases_cache is not None:
+            return self.catchphrases_cache
+        else:
+            names = self.catchphrases.values_list('name', flat=True)
+        return "".join(name + " " for name in names)
+
+    def refresh_catchphrases_cache(self):
+        self.catchphrases_cache = "".join(name + " " for name in self.catchphrases.values_list('name', flat=True))
+        # update() skips auto_now, bump updated_at for the incremental reindex
+        Product.objects.filter(pk=self.pk).update(catchphrases_cache=self.catchphrases_cache, updated_at=timezone.now())
+        product_snapshots.invalidate(self.pk)
     
     def price_cleaned(self):
         p = self.unit_price
@@ -274,6 +498,39 @@ class Product(CMSPageReferenceMixin, TranslatableModelMixin, BaseProduct):
         return self.images.first()
 
 
+def clear_catchphrases_cache(catchphrase):
+    products = Product.objects.filter(catchphrases=catchphrase)
+    product_snapshots.invalidate(*products.values_list('pk', flat=True))
+    products.update(catchphrases_cache=None, updated_at=timezone.now())
+
+
+@receiver(m2m_changed, sender=Product.catchphrases.through)
+def refresh_catchphrases(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse and action == 'pre_clear':
+        # pk_set is None on clear, so drop the values while the links exist
+        clear_catchphrases_cache(instance)
+    elif action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    elif not reverse:
+        instance.refresh_catchphrases_cache()
+    elif pk_set:
+        for product in Product.objects.filter(pk__in=pk_set):
+            product.refresh_catchphrases_cache()
+
+
+@receiver(pre_delete, sender=Catchphrase)
+def delete_catchphrase(sender, instance, **kwargs):
+    # the cascade on the through table sends no m2m_changed
+    clear_catchphrases_cache(instance)
+
+
+@receiver(post_save, sender=Catchphrase)
+def rename_catchphrase(sender, instance, created, **kwargs):
+    if not created:
+        for product in Product.objects.filter(catchphrases=instance):
+            product.refresh_catchphrases_cache()
+
+
 class ProductTranslation(TranslatedFieldsModel):
     master = models.ForeignKey(
         Product,
@@ -372,3 +629,93 @@ class Album(AvailableProductMixin, Product):
         return self.unit_price
 
     default_manager = ProductManager()
+
+
+class ProductSnapshotCache:
+    # Read-through cache of the rendered fields of a product, one entry per
+    # product and language. Entries are plain dicts, so any cache backend
+    # works. Invalidation only reaches other processes (web workers, the FTP
+    # server packaging videos, the admin) through a shared backend such as
+    # Redis or Memcached; with a per-process LocMemCache the timeout is what
+    # bounds how long an entry can be stale.
+    def __init__(self, alias='default', timeout=300):
+        self.alias = alias
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, pk, language):
+        return f"product-snapshot:{pk}:{language}"
+
+    def get(self, pk, language=None):
+        language = language or get_language()
+        cache = caches[self.alias]
+        snapshot = cache.get(self.key(pk, language))
+        if snapshot is not None:
+            self.hits += 1
+            return snapshot
+        self.misses += 1
+        try:
+            product = Product.objects.all().with_media_paths().with_catchphrases().get(pk=pk)
+        except Product.DoesNotExist:
+            return None
+        snapshot = self.build(product, language)
+        cache.set(self.key(pk, language), snapshot, self.timeout)
+        return snapshot
+
+    def build(self, product, language):
+        product.set_current_language(language)
+        return {
+            'id': product.pk,
+            'product_name': product.product_name,
+            'slug': product.slug,
+            'product_type': product.product_type(),
+            'caption': product.safe_translation_getter('caption', any_language=True),
+            'description': product.safe_translation_getter('description', any_language=True),
+            'price': str(product.get_price(None)),
+            'videofile_path': product.get_videofile_path(),
+            'subtitles_path': product.get_subtitles_path(),
+            'image_path': product.get_image_path(),
+            'catchphrases': product.catchphrases_as_string(),
+        }
+
+    def invalidate(self, *pks):
+        languages = [code for code, name in django_settings.LANGUAGES]
+        caches[self.alias].delete_many([self.key(pk, language) for pk in pks for language in languages])
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / total if total else 0.0}
+
+
+product_snapshots = ProductSnapshotCache(
+    getattr(django_settings, 'PRODUCT_SNAPSHOT_CACHE', 'default'),
+    getattr(django_settings, 'PRODUCT_SNAPSHOT_TIMEOUT', 300),
+)
+
+
+def invalidate_product(sender, instance, **kwargs):
+    product_snapshots.invalidate(instance.pk)
+
+
+def invalidate_translation(sender, instance, **kwargs):
+    product_snapshots.invalidate(instance.master_id)
+
+
+def invalidate_media(sender, instance, **kwargs):
+    product_snapshots.invalidate(instance.product_id)
+    Product.objects.filter(pk=instance.product_id).update(updated_at=timezone.now())
+
+
+# model signals are sent with the concrete class as sender, so every child
+# model and each of its translation tables needs its own connection
+for model in (Product, Commodity, Video, Album):
+    post_save.connect(invalidate_product, sender=model)
+    post_delete.connect(invalidate_product, sender=model)
+    for meta in model._parler_meta:
+        post_save.connect(invalidate_translation, sender=meta.model)
+        post_delete.connect(invalidate_translation, sender=meta.model)
+
+for model in (ProductVideo, ProductSubtitles, ProductImage):
+    post_save.connect(invalidate_media, sender=model)
+    post_delete.connect(invalidate_media, sender=model)
@@ -1,26 +1,89 @@
 import os
 import csv
+import json
+import time
+import cProfile
+import logging
+import gzip
+import shutil
+import tempfile
+import hashlib
+import argparse
+import ast
+import io
 import math
+import heapq
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from array import array
+from itertools import islice
+from collections import deque
+import numpy as np
 import networkx as nx 
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+logger = logging.getLogger(__name__)
+
+
+def open_zstd(path, mode):
+    if zstandard is None:
+        raise ImportError("zstd-compressed files need the zstandard package")
+    if mode == 'r':
+        stream = zstandard.ZstdDecompressor().stream_reader(open(path, mode='rb'), closefd=True)
+    else:
+        stream = zstandard.ZstdCompressor().stream_writer(open(path, mode='wb'), closefd=True)
+    return io.TextIOWrapper(stream, encoding='UTF8', newline='')
+
+
+def open_csv(path):
+    # plain, gzip (.csv.gz) or zstd (.csv.zst) compressed input
+    if path.endswith(".gz"):
+        return gzip.open(path, mode='rt', encoding='UTF8', newline='')
+    if path.endswith(".zst"):
+        return open_zstd(path, 'r')
+    return open(path, mode='r', newline='')
+
+
+def open_output(path):
+    # plain, gzip (.csv.gz) or zstd (.csv.zst) compressed output
+    if path.endswith(".gz"):
+        return gzip.open(path, mode='wt', encoding='UTF8', newline='')
+    if path.endswith(".zst"):
+        return open_zstd(path, 'w')
+    return open(path, mode='w', encoding='UTF8', newline='')
+
+
+def split_output(path):
+    # "final.csv.gz" -> ("final", ".csv.gz")
+    name, extension = os.path.splitext(path)
+    if extension in (".gz", ".zst"):
+        name, inner = os.path.splitext(name)
+        extension = inner + extension
+    return name, extension
+
 
 def open_tables(nodes, edges):
     # 1. nodes.csv -> Dictionary{label:[x,y]}
-    with open(nodes, mode='r') as csv_file:
+    with open_csv(nodes) as csv_file:
         csv_reader = csv.DictReader(csv_file)
         line_count = 0
         for row in csv_reader:
             if line_count == 0:
                 nodedict = {}
                 line_count += 1
-            print(row["label"])
-            nodedict[row["label"]] = {"x": row["x"], "y": row["y"]}
+            logger.debug("%s", row["label"])
+            nodedict[row["label"]] = {"x": float(row["x"]), "y": float(row["y"])}
             line_count += 1
-        print(f'Processed {line_count} lines.')
-        print(nodedict)
+        logger.info("Processed %d lines.", line_count)
+        logger.debug("%s", nodedict)
 
     # 2. edges.csv -> List[(node1, node2)]
-    with open(edges, mode='r') as csv_file:
+    with open_csv(edges) as csv_file:
         csv_reader = csv.DictReader(csv_file)
         line_count = 0
         for row in csv_reader:
@@ -29,8 +92,8 @@ def open_tables(nodes, edges):
                 line_count += 1
             edgelist.append((row["node1"], row["node2"]))
             line_count += 1
-        print(f'Processed {line_count} lines.')
-        print(edgelist)
+        logger.info("Processed %d lines.", line_count)
+        logger.debug("%s", edgelist)
 
     # 3. next, create the graph
     mDG = nx.MultiDiGraph()
@@ -39,52 +102,1195 @@ def open_tables(nodes, edges):
             (i, {"x": nodedict[i]["x"], "y": nodedict[i]["y"]}),
         ])
     mDG.add_edges_from(edgelist)
-    print(mDG)
+    edge_table(mDG)
+    mDG.graph["acyclic"] = nx.is_directed_acyclic_graph(mDG)
+    logger.info("%s", mDG)
+
+    return mDG, nodedict
+
+
+def read_columns(path, columns, chunksize=65536):
+    # reads the named columns of a csv file chunk by chunk, without a dict
+    # per row; returns the number of rows and one list per column
+    with open_csv(path) as csv_file:
+        csv_reader = csv.reader(csv_file)
+        header = next(csv_reader)
+        indices = [header.index(column) for column in columns]
+        values = [[] for _ in columns]
+        line_count = 0
+        while True:
+            chunk = list(islice(csv_reader, chunksize))
+            if not chunk:
+                break
+            line_count += len(chunk)
+            for index, value in zip(indices, values):
+                value.extend([row[index] for row in chunk])
+    return line_count, values
+
+
+def load_tables(nodes, edges, chunksize=65536):
+    # bulk version of open_tables: same result, built in one batch and with
+    # a single summary line instead of printing every row
+    # 1. nodes.csv -> labels with integer ids + float coordinate arrays
+    nodecount, (labels, x, y) = read_columns(nodes, ["label", "x", "y"], chunksize)
+    nodeids = {label: i for i, label in enumerate(labels)}
+    x = np.array(x, dtype=np.float64)
+    y = np.array(y, dtype=np.float64)
+
+    # 2. edges.csv -> integer id arrays
+    edgecount, (node1, node2) = read_columns(edges, ["node1", "node2"], chunksize)
+    try:
+        first = np.fromiter((nodeids[label] for label in node1), dtype=np.int64, count=len(node1))
+        second = np.fromiter((nodeids[label] for label in node2), dtype=np.int64, count=len(node2))
+    except KeyError as e:
+        raise ValueError(f"Edge refers to unknown node {e.args[0]!r}") from None
 
+    # 3. the graph, in one batch per nodes and edges
+    xs = x.tolist()
+    ys = y.tolist()
+    nodedict = {label: {"x": xs[i], "y": ys[i]} for i, label in enumerate(labels)}
+    mDG = nx.MultiDiGraph()
+    mDG.add_nodes_from(nodedict.items())
+    mDG.add_edges_from(zip([labels[i] for i in first.tolist()], [labels[i] for i in second.tolist()]))
+    mDG.graph["nodeids"] = nodeids
+    mDG.graph["x"] = x
+    mDG.graph["y"] = y
+    edge_table(mDG)
+    mDG.graph["acyclic"] = nx.is_directed_acyclic_graph(mDG)
+    logger.info("Processed %d nodes and %d edges: %s", nodecount, edgecount, mDG)
+
+    return mDG, nodedict
+
+
+def content_hash(*paths):
+    sha = hashlib.sha256()
+    for path in paths:
+        with open(path, mode='rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                sha.update(block)
+        sha.update(b"\0")
+    return sha.hexdigest()
+
+
+# part of the cache key; changes whenever the cached values are computed
+# differently, so older caches are rebuilt
+CACHE_VERSION = 2
+
+
+def cache_dir(nodes, edges):
+    # one cache per pair of input files, next to the node table
+    name1 = os.path.basename(nodes)
+    name2 = os.path.basename(edges)
+    return os.path.join(os.path.dirname(os.path.abspath(nodes)), f".{name1}.{name2}.routescache")
+
+
+def save_cache(multiDiGraph, cachedir, key):
+    # the graph as .npy arrays (memory-mappable on load) in cachedir/<key>.
+    # They are written to a temporary directory that is renamed into place
+    # when complete, so concurrent runs never see a half-written cache and
+    # a cache being loaded is never rewritten; caches of other keys (older
+    # versions of the input files) are removed afterwards
+    edgeids, lengths = edge_table(multiDiGraph)
+    os.makedirs(cachedir, exist_ok=True)
+    tmpdir = tempfile.mkdtemp(prefix=".tmp-", dir=cachedir)
+    try:
+        labels = list(multiDiGraph.nodes)
+        nodeids = {label: i for i, label in enumerate(labels)}
+        edges = multiDiGraph.graph["edges"]
+        np.save(os.path.join(tmpdir, "labels.npy"), np.array(labels, dtype=str))
+        np.save(os.path.join(tmpdir, "x.npy"), np.array([multiDiGraph.nodes[label]["x"] for label in labels], dtype=np.float64))
+        np.save(os.path.join(tmpdir, "y.npy"), np.array([multiDiGraph.nodes[label]["y"] for label in labels], dtype=np.float64))
+        np.save(os.path.join(tmpdir, "edges.npy"), np.array(
+            [(nodeids[u], nodeids[v], key) for u, v, key in edges], dtype=np.int64).reshape(-1, 3))
+        np.save(os.path.join(tmpdir, "lengths.npy"), lengths)
+        np.save(os.path.join(tmpdir, "acyclic.npy"), np.array(is_acyclic(multiDiGraph)))
+        os.replace(tmpdir, os.path.join(cachedir, key))
+    except OSError:
+        # another run finished the same cache first
+        shutil.rmtree(tmpdir, ignore_errors=True)
+        if not os.path.isdir(os.path.join(cachedir, key)):
+            raise
+    for name in os.listdir(cachedir):
+        path = os.path.join(cachedir, name)
+        if name == key or name.startswith(".tmp-"):
+            continue
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            os.remove(path)
+
+
+def load_cache(cachedir, key):
+    # the graph of save_cache, or None if there is no cache for this key
+    # (or it was removed while loading it)
+    cachedir = os.path.join(cachedir, key)
+    try:
+        return read_cache(cachedir)
+    except FileNotFoundError:
+        return None
+
+
+def read_cache(cachedir):
+    def load(name):
+        return np.load(os.path.join(cachedir, f"{name}.npy"), mmap_mode='r')
+
+    labels = load("labels").tolist()
+    x = np.array(load("x"))
+    y = np.array(load("y"))
+    edgearray = load("edges")
+    lengths = np.array(load("lengths"))
+
+    xs = x.tolist()
+    ys = y.tolist()
+    nodedict = {label: {"x": xs[i], "y": ys[i]} for i, label in enumerate(labels)}
+    edges = [(labels[u], labels[v], key) for u, v, key in edgearray.tolist()]
+    mDG = nx.MultiDiGraph()
+    mDG.add_nodes_from(nodedict.items())
+    # re-adding the edges in graph order gives the same edge order and keys
+    mDG.add_edges_from((u, v, key, {"id": i, "length": length})
+                       for i, ((u, v, key), length) in enumerate(zip(edges, lengths.tolist())))
+    mDG.graph["nodeids"] = {label: i for i, label in enumerate(labels)}
+    mDG.graph["x"] = x
+    mDG.graph["y"] = y
+    mDG.graph["edges"] = edges
+    mDG.graph["edgeids"] = {edge: i for i, edge in enumerate(edges)}
+    mDG.graph["lengths"] = lengths
+    mDG.graph["acyclic"] = bool(load("acyclic"))
     return mDG, nodedict
 
 
-def create_table(multiDiGraph, nodedict, finalpath):
-    # 1. get all paths + their lengths
-    pathlengths = []
-    mappingdict = {}
-    edgelengths = {}
-    for path in nx.all_simple_edge_paths(multiDiGraph, "Source", "Target"):
-        lengthofpath = 0
-        for i in path:
-            print(path)
-            if i in edgelengths:
-                lengthofpath = lengthofpath + edgelengths[i]
-            else:
-                firstnode = i[0]
-                secondnode = i[1]
-                x = int(nodedict[secondnode]["x"]) - int(nodedict[firstnode]["x"])
-                y = int(nodedict[secondnode]["y"]) - int(nodedict[firstnode]["y"])
-                lengthofedge = math.hypot(x, y)
-                edgelengths[i] = lengthofedge
-                lengthofpath = lengthofpath + lengthofedge
-        mappingdict[lengthofpath] = path
-        pathlengths.append(lengthofpath)
-    
-    # 2. the data needs to get prepared
-    pathlengths.sort(reverse=True)
-    final = []
-    for i in pathlengths:
-        pair = [i, mappingdict[i]]
-        final.append(pair)
-
-    # 3. now the .csv file needs to be filled
-    with open(finalpath, 'w', encoding='UTF8', newline='') as f:
-        writer = csv.writer(f)
-        writer.writerow(["length", "route"])
-        writer.writerows(final)
-
-
-def calculate(nodefile, edgefile, finalpath):
-    name1, extension1 = os.path.splitext(nodefile)
-    name2, extension2 = os.path.splitext(edgefile)
-    if extension1 == ".csv" and extension2 == ".csv":
-        multiDiGraph, nodedict = open_tables(nodefile, edgefile)
-        create_table(multiDiGraph, nodedict, finalpath)
+def cached_tables(nodes, edges, chunksize=65536):
+    # load_tables, but served from an on-disk cache while neither input
+    # file changes; a changed file changes the key and rebuilds the cache
+    cachedir = cache_dir(nodes, edges)
+    key = f"v{CACHE_VERSION}-{content_hash(nodes, edges)}"
+    cached = load_cache(cachedir, key)
+    if cached is not None:
+        logger.info("Loaded %s from cache.", cached[0])
+        return cached
+    multiDiGraph, nodedict = load_tables(nodes, edges, chunksize)
+    save_cache(multiDiGraph, cachedir, key)
+    return multiDiGraph, nodedict
+
+
+def edge_table(multiDiGraph):
+    # computes all edge lengths once, in one vectorized pass. Every edge gets
+    # an integer "id" and a "length" attribute; the id -> length array is kept
+    # on the graph so path lengths become array sums over edge ids.
+    if "lengths" not in multiDiGraph.graph:
+        edges = list(multiDiGraph.edges(keys=True))
+        if "nodeids" in multiDiGraph.graph:
+            # coordinate arrays left by load_tables
+            nodeids = multiDiGraph.graph["nodeids"]
+            x = multiDiGraph.graph["x"]
+            y = multiDiGraph.graph["y"]
+        else:
+            nodeids = {node: i for i, node in enumerate(multiDiGraph.nodes)}
+            x = np.array([float(multiDiGraph.nodes[node]["x"]) for node in nodeids])
+            y = np.array([float(multiDiGraph.nodes[node]["y"]) for node in nodeids])
+        first = np.array([nodeids[edge[0]] for edge in edges], dtype=np.int64)
+        second = np.array([nodeids[edge[1]] for edge in edges], dtype=np.int64)
+        # math.hypot like the original loop: np.hypot differs from it in
+        # the last digit for some edges
+        lengths = np.array(list(map(math.hypot, (x[second] - x[first]).tolist(), (y[second] - y[first]).tolist())),
+                           dtype=np.float64)
+
+        edgeids = {edge: i for i, edge in enumerate(edges)}
+        nx.set_edge_attributes(multiDiGraph, edgeids, "id")
+        nx.set_edge_attributes(multiDiGraph, dict(zip(edges, lengths.tolist())), "length")
+        multiDiGraph.graph["edges"] = edges
+        multiDiGraph.graph["edgeids"] = edgeids
+        multiDiGraph.graph["lengths"] = lengths
+    return multiDiGraph.graph["edgeids"], multiDiGraph.graph["lengths"]
+
+
+def path_length(path, edgeids, lengths):
+    # added up from left to right like the original loop; numpy's pairwise
+    # sum (and sum() from Python 3.12 on) can change the last digit
+    lengthofpath = 0.0
+    for length in lengths[[edgeids[edge] for edge in path]].tolist():
+        lengthofpath += length
+    return lengthofpath
+
+
+def bounded_paths(multiDiGraph, bounds, prefix=None, source="Source", target="Target"):
+    # depth-first search over simple paths from source to target in the
+    # order of nx.all_simple_edge_paths, cutting a branch as soon as it
+    # cannot meet the bounds:
+    #   "max_hops":   at most this many edges
+    #   "max_length": partial length (plus the straight-line distance to
+    #                 target if "euclidean" is set) may not exceed it
+    #   "min_length": checked on complete paths only
+    #   "through":    set of (u, v, key) edges, a path has to use one of
+    #                 them; cut once none of them can be reached any more
+    # prefix (a list of edges out of source) restricts the search to the
+    # paths starting with it
+    edgeids, lengths = edge_table(multiDiGraph)
+    max_hops = bounds.get("max_hops")
+    min_length = bounds.get("min_length")
+    max_length = bounds.get("max_length")
+    remaining = {}
+    if bounds.get("euclidean"):
+        tx = float(multiDiGraph.nodes[target]["x"])
+        ty = float(multiDiGraph.nodes[target]["y"])
+        for node, data in multiDiGraph.nodes(data=True):
+            remaining[node] = math.hypot(tx - float(data["x"]), ty - float(data["y"]))
+    if max_length is not None:
+        # partial sums are not added up like path_length does; never cut
+        # a path whose exact length lies on the bound
+        max_length = max_length + 1e-9 * max(abs(max_length), 1.0)
+    through = bounds.get("through")
+    if through is not None:
+        # nodes from which one of the edges can still be reached
+        reach = set()
+        for u, v, key in through:
+            if u not in reach:
+                reach.add(u)
+                reach.update(nx.ancestors(multiDiGraph, u))
+
+    path = []
+    partial = [0.0]
+    hits = [0]
+    visited = {source}
+    if prefix:
+        # the bounds only tighten along a path, so checking the last edge of
+        # the prefix in the loop below also covers the edges before it
+        for u, v, key in prefix[:-1]:
+            path.append((u, v, key))
+            partial.append(partial[-1] + multiDiGraph.edges[u, v, key]["length"])
+            hits.append(hits[-1] + (through is not None and (u, v, key) in through))
+            visited.add(v)
+        firstedges = [tuple(prefix[-1]) + (multiDiGraph.edges[prefix[-1]]["length"],)]
+    else:
+        firstedges = multiDiGraph.out_edges(source, keys=True, data="length")
+    stack = [iter(firstedges)]
+    while stack:
+        edge = next(stack[-1], None)
+        if edge is None:
+            stack.pop()
+            if path:
+                visited.discard(path.pop()[1])
+                partial.pop()
+                hits.pop()
+            continue
+        u, v, key, weight = edge
+        if v in visited:
+            continue
+        if max_hops is not None and len(path) >= max_hops:
+            continue
+        lengthofpath = partial[-1] + weight
+        if max_length is not None and lengthofpath + remaining.get(v, 0.0) > max_length:
+            continue
+        hit = hits[-1]
+        if through is not None:
+            hit += (u, v, key) in through
+            if not hit and v not in reach:
+                continue
+        if v == target:
+            found = path + [(u, v, key)]
+            lengthofpath = path_length(found, edgeids, lengths)
+            if ((min_length is None or lengthofpath >= min_length)
+                    and (bounds.get("max_length") is None or lengthofpath <= bounds["max_length"])
+                    and (through is None or hit)):
+                yield lengthofpath, found
+            continue
+        path.append((u, v, key))
+        partial.append(lengthofpath)
+        hits.append(hit)
+        visited.add(v)
+        stack.append(iter(multiDiGraph.out_edges(v, keys=True, data="length")))
+
+
+def split_paths(multiDiGraph, count, source="Source", target="Target"):
+    # prefixes of the simple paths out of source, in the order the serial
+    # search visits them, extended one edge at a time until there are at
+    # least count of them (or none can be extended any more)
+    prefixes = [[edge] for edge in multiDiGraph.out_edges(source, keys=True)]
+    while len(prefixes) < count:
+        extended = []
+        grew = False
+        for prefix in prefixes:
+            if prefix[-1][1] == target:
+                extended.append(prefix)
+                continue
+            visited = {source}.union(edge[1] for edge in prefix)
+            for edge in multiDiGraph.out_edges(prefix[-1][1], keys=True):
+                if edge[1] not in visited:
+                    extended.append(prefix + [edge])
+                    grew = True
+        prefixes = extended
+        if not grew:
+            break
+    return prefixes
+
+
+_worker_graph = None
+_worker_bounds = None
+_worker_terminals = ("Source", "Target")
+
+
+def _init_worker(multiDiGraph, bounds, source="Source", target="Target"):
+    global _worker_graph, _worker_bounds, _worker_terminals
+    _worker_graph = multiDiGraph
+    _worker_bounds = bounds
+    _worker_terminals = (source, target)
+
+
+def _enumerate_prefix(task):
+    # -> the paths starting with prefix as PathStore arrays, reduced to the
+    # k best (kept in the order they were found) when k is given, plus the
+    # number of paths and edges seen
+    prefix, k, longest = task
+    paths = bounded_paths(_worker_graph, _worker_bounds or {}, prefix, *_worker_terminals)
+    seen = edges = 0
+    if k is not None:
+        heap = []
+        for count, (lengthofpath, path) in enumerate(paths):
+            seen += 1
+            edges += len(path)
+            key = lengthofpath if longest else -lengthofpath
+            if len(heap) < k:
+                heapq.heappush(heap, (key, -count, lengthofpath, path))
+            elif key > heap[0][0]:
+                heapq.heapreplace(heap, (key, -count, lengthofpath, path))
+        paths = [(lengthofpath, path) for key, count, lengthofpath, path in sorted(heap, key=lambda item: -item[1])]
+    store = PathStore(_worker_graph)
+    for lengthofpath, path in paths:
+        store.append(lengthofpath, path)
+        if k is None:
+            seen += 1
+            edges += len(path)
+    return store.ids, store.offsets, store.lengths, seen, edges
+
+
+def parallel_paths(multiDiGraph, workers, bounds=None, source="Source", target="Target", split=16, k=None,
+                   longest=True, stats=None):
+    # splits the search into at least workers * split path prefixes (see
+    # split_paths) and enumerates each in a process of the pool. Results are
+    # merged in prefix order, the order the serial search visits them in, so
+    # the output is identical to the serial run. Only a window of finished
+    # prefixes is held at a time. With k, each worker keeps only the k best
+    # paths of its prefix (top_paths picks the same rows from those), and
+    # the paths it dropped are added to the counters of stats.
+    edge_table(multiDiGraph)
+    prefixes = split_paths(multiDiGraph, workers * split, source, target)
+    pending = deque()
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(multiDiGraph, bounds, source, target)) as executor:
+        tasks = iter(prefixes)
+        for prefix in islice(tasks, 2 * workers):
+            pending.append(executor.submit(_enumerate_prefix, (prefix, k, longest)))
+        while pending:
+            ids, offsets, lengths, seen, edges = pending.popleft().result()
+            prefix = next(tasks, None)
+            if prefix is not None:
+                pending.append(executor.submit(_enumerate_prefix, (prefix, k, longest)))
+            branch = PathStore(multiDiGraph)
+            branch.extend(ids, offsets, lengths)
+            if stats is not None:
+                stats.counters["paths"] += seen - len(branch)
+                stats.counters["edges"] += edges - len(ids)
+            yield from branch.items()
+
+
+def iter_paths(multiDiGraph, workers=None, bounds=None, source="Source", target="Target", stats=None, split=16,
+               k=None, longest=True):
+    # yields (length, path) for every simple path from source to target
+    # (within bounds, see bounded_paths); paths are logged at DEBUG level.
+    # With workers > 1 and k, only paths that can be among the k best (see
+    # parallel_paths) are yielded
+    edgeids, lengths = edge_table(multiDiGraph)
+    if workers is not None and workers > 1:
+        paths = parallel_paths(multiDiGraph, workers, bounds, source, target, split, k, longest, stats)
+    elif bounds:
+        paths = bounded_paths(multiDiGraph, bounds, None, source, target)
+    else:
+        paths = ((path_length(path, edgeids, lengths), path)
+                 for path in nx.all_simple_edge_paths(multiDiGraph, source, target))
+    debug = logger.isEnabledFor(logging.DEBUG)
+    for lengthofpath, path in paths:
+        if debug:
+            logger.debug("%s %s", lengthofpath, path)
+        if stats is not None:
+            stats.count_path(path)
+        yield lengthofpath, path
+
+
+class PathStore:
+    # holds every route as edge ids in one flat array plus offsets (CSR
+    # layout), so routes of equal length are all kept and no tuples are
+    # stored per path. Sorting only reorders indices, never the paths.
+    def __init__(self, multiDiGraph):
+        self.edgeids, _ = edge_table(multiDiGraph)
+        self.edges = multiDiGraph.graph["edges"]
+        self.ids = array("i")
+        self.offsets = array("q", [0])
+        self.lengths = array("d")
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def append(self, lengthofpath, path):
+        self.ids.extend(self.edgeids[edge] for edge in path)
+        self.offsets.append(len(self.ids))
+        self.lengths.append(lengthofpath)
+
+    def extend(self, ids, offsets, lengths):
+        # appends the arrays of another store, e.g. one built in a worker
+        start = len(self.ids)
+        self.ids.extend(ids)
+        self.offsets.extend(start + offset for offset in offsets[1:])
+        self.lengths.extend(lengths)
+
+    def path(self, i):
+        return [self.edges[j] for j in self.ids[self.offsets[i]:self.offsets[i + 1]]]
+
+    def items(self):
+        # (length, path) pairs in insertion order
+        for i in range(len(self)):
+            yield self.lengths[i], self.path(i)
+
+    def order(self, longest=True):
+        lengths = np.frombuffer(self.lengths, dtype=np.float64)
+        return np.argsort(-lengths if longest else lengths, kind="stable")
+
+    def rows(self, longest=True, order=None):
+        # [length, route] rows in the layout of final.csv
+        if order is None:
+            order = self.order(longest)
+        for i in order.tolist():
+            yield [self.lengths[i], self.path(i)]
+
+
+class Instrumentation:
+    # timings and counters of one run: phase timers ("load", "enumerate",
+    # "sort", "write"), counts of paths and of the edges on them, progress
+    # in paths per second at INFO level every progress_interval seconds,
+    # and optionally a cProfile of all phases, written to profile
+    def __init__(self, progress_interval=5.0, profile=None):
+        self.phases = {}
+        self.counters = {"paths": 0, "edges": 0}
+        self.progress_interval = progress_interval
+        self.profile = profile
+        self.profiler = cProfile.Profile() if profile else None
+        self.started = time.perf_counter()
+        self.last_progress = self.started
+
+    @contextmanager
+    def phase(self, name):
+        if self.profiler is not None:
+            self.profiler.enable()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+            if self.profiler is not None:
+                self.profiler.disable()
+
+    def count_path(self, path):
+        self.counters["paths"] += 1
+        self.counters["edges"] += len(path)
+        if self.counters["paths"] % 1024 == 0:
+            now = time.perf_counter()
+            if now - self.last_progress >= self.progress_interval:
+                self.last_progress = now
+                logger.info("%d paths, %.0f paths/s", self.counters["paths"],
+                            self.counters["paths"] / (now - self.started))
+
+    def summary(self, **extra):
+        seconds = time.perf_counter() - self.started
+        summary = dict(extra)
+        summary.update(self.counters)
+        summary["phases"] = dict(self.phases)
+        summary["seconds"] = seconds
+        summary["paths_per_second"] = self.counters["paths"] / seconds if seconds else None
+        return summary
+
+    def finish(self, **extra):
+        # logs the summary as one line of JSON and writes the profile
+        summary = self.summary(**extra)
+        if self.profiler is not None:
+            self.profiler.dump_stats(self.profile)
+        logger.info("%s", json.dumps(summary))
+        return summary
+
+
+def top_paths(multiDiGraph, k, longest=True, workers=None, bounds=None, source="Source", target="Target", stats=None,
+              split=16):
+    # keeps only the k best paths in a heap, so memory stays at O(k)
+    heap = []
+    paths = iter_paths(multiDiGraph, workers, bounds, source, target, stats, split, k, longest)
+    for count, (lengthofpath, path) in enumerate(paths):
+        # the counter breaks ties, paths themselves are never compared
+        key = lengthofpath if longest else -lengthofpath
+        if len(heap) < k:
+            heapq.heappush(heap, (key, -count, path))
+        elif key > heap[0][0]:
+            heapq.heapreplace(heap, (key, -count, path))
+    heap.sort(reverse=True)
+    return [[key if longest else -key, path] for key, count, path in heap]
+
+
+def best_path(multiDiGraph, source, removed_nodes, removed_edges, order=None, target="Target"):
+    # shortest path from source to target (Dijkstra), or the longest one if
+    # a topological order is given; None if target cannot be reached
+    dist = {source: 0}
+    pred = {}
+    if order is None:
+        heap = [(0, 0, source)]
+        done = set()
+        count = 1
+        while heap:
+            d, _, u = heapq.heappop(heap)
+            if u in done:
+                continue
+            done.add(u)
+            if u == target:
+                break
+            for _, v, key, weight in multiDiGraph.out_edges(u, keys=True, data="length"):
+                edge = (u, v, key)
+                if v in removed_nodes or v in done or edge in removed_edges:
+                    continue
+                nd = d + weight
+                if v not in dist or nd < dist[v]:
+                    dist[v] = nd
+                    pred[v] = edge
+                    heapq.heappush(heap, (nd, count, v))
+                    count += 1
+    else:
+        for u in order[order.index(source):]:
+            if u not in dist:
+                continue
+            for _, v, key, weight in multiDiGraph.out_edges(u, keys=True, data="length"):
+                edge = (u, v, key)
+                if v in removed_nodes or edge in removed_edges:
+                    continue
+                nd = dist[u] + weight
+                if v not in dist or nd > dist[v]:
+                    dist[v] = nd
+                    pred[v] = edge
+
+    if target not in pred:
+        return None
+    path = []
+    node = target
+    while node != source:
+        path.append(pred[node])
+        node = pred[node][0]
+    path.reverse()
+    return tuple(path)
+
+
+def edge_positions(multiDiGraph):
+    # the depth-first search visits paths in lexicographic order of the
+    # positions of their edges among the out-edges of each node
+    position = {}
+    for node in multiDiGraph:
+        for i, edge in enumerate(multiDiGraph.out_edges(node, keys=True)):
+            position[edge] = i
+    return position
+
+
+def ranked_paths(multiDiGraph, k, longest=True, source="Source", target="Target"):
+    # Yen's algorithm: returns the k best simple paths without enumerating
+    # all of them. Edge paths keep parallel edges apart. Paths of equal
+    # length are returned in the order the depth-first search visits them,
+    # like mode "top" does; where several paths tie with the k-th one, which
+    # of them are returned can differ from "top". Longest paths are only
+    # well-defined this way on acyclic networks.
+    if longest and not nx.is_directed_acyclic_graph(multiDiGraph):
+        raise ValueError("Ranked longest routes need an acyclic network")
+    order = list(nx.topological_sort(multiDiGraph)) if longest else None
+
+    edgeids, lengths = edge_table(multiDiGraph)
+    position = edge_positions(multiDiGraph)
+
+    first = best_path(multiDiGraph, source, set(), set(), order, target)
+    if first is None:
+        return []
+    found = [first]
+    candidates = []
+    seen = {first}
+    while len(found) < k:
+        previous = found[-1]
+        nodes = [edge[0] for edge in previous]
+        for i in range(len(previous)):
+            root = previous[:i]
+            removed_edges = {p[i] for p in found if len(p) > i and p[:i] == root}
+            removed_nodes = set(nodes[:i])
+            spur = best_path(multiDiGraph, nodes[i], removed_nodes, removed_edges, order, target)
+            if spur is None:
+                continue
+            path = root + spur
+            if path in seen:
+                continue
+            seen.add(path)
+            lengthofpath = path_length(path, edgeids, lengths)
+            # equally long candidates are taken in depth-first order
+            key = -lengthofpath if longest else lengthofpath
+            heapq.heappush(candidates, (key, [position[edge] for edge in path], path))
+        if not candidates:
+            break
+        found.append(heapq.heappop(candidates)[2])
+
+    rows = [[path_length(path, edgeids, lengths), list(path)] for path in found]
+    rows.sort(key=lambda row: (-row[0] if longest else row[0], [position[edge] for edge in row[1]]))
+    return rows
+
+
+def is_acyclic(multiDiGraph):
+    if "acyclic" not in multiDiGraph.graph:
+        multiDiGraph.graph["acyclic"] = nx.is_directed_acyclic_graph(multiDiGraph)
+    return multiDiGraph.graph["acyclic"]
+
+
+def dag_summary(multiDiGraph, bins=20, source="Source", target="Target"):
+    # path count, shortest/longest route and a length histogram of an
+    # acyclic network by dynamic programming over the topological order,
+    # in O(V+E) instead of walking every path
+    if not is_acyclic(multiDiGraph):
+        raise ValueError("A summary needs an acyclic network")
+    edgeids, lengths = edge_table(multiDiGraph)
+    # only nodes reachable from source that can reach target lie on a
+    # route; their edges are collected in one pass over the edge view
+    nodes = (nx.descendants(multiDiGraph, source) | {source}) & (nx.ancestors(multiDiGraph, target) | {target})
+    out_edges = {u: [] for u in nodes}
+    indegree = dict.fromkeys(nodes, 0)
+    for u, v, key, weight in multiDiGraph.edges(keys=True, data="length"):
+        if u in nodes and v in nodes:
+            out_edges[u].append((v, key, weight))
+            indegree[v] += 1
+    # topological order (Kahn's algorithm)
+    order = [source] if source in nodes else []
+    for u in order:
+        for v, key, weight in out_edges[u]:
+            indegree[v] -= 1
+            if not indegree[v]:
+                order.append(v)
+
+    # 1. counts (exact, python ints) and shortest/longest distances
+    count = {source: 1}
+    low = {source: 0.0}
+    high = {source: 0.0}
+    lowpred = {}
+    highpred = {}
+    for u in order:
+        if u not in count or u == target:
+            continue
+        for v, key, weight in out_edges[u]:
+            count[v] = count.get(v, 0) + count[u]
+            if v not in low or low[u] + weight < low[v]:
+                low[v] = low[u] + weight
+                lowpred[v] = (u, v, key)
+            if v not in high or high[u] + weight > high[v]:
+                high[v] = high[u] + weight
+                highpred[v] = (u, v, key)
+
+    summary = {"paths": count.get(target, 0), "shortest": None, "longest": None, "histogram": []}
+    if summary["paths"] == 0:
+        return summary
+    for name, pred in (("shortest", lowpred), ("longest", highpred)):
+        path = []
+        node = target
+        while node != source:
+            path.append(pred[node])
+            node = pred[node][0]
+        path.reverse()
+        summary[name] = [path_length(path, edgeids, lengths), path]
+
+    # 2. histogram: every node carries path counts over lengths rounded to a
+    # fine resolution, shifted along each edge. Counts are floats times
+    # 2**exponent (one exponent per node), so they cannot overflow; the
+    # histogram is approximate for very large path counts and near bin
+    # borders (per-edge rounding, lengths rounded past the longest route
+    # are kept in the last slot)
+    shortest = summary["shortest"][0]
+    longest = summary["longest"][0]
+    resolution = longest / (bins * 64) if longest > 0 else 1.0
+    size = int(round(longest / resolution)) + 1
+    hist = {source: [np.zeros(size), 0]}
+    hist[source][0][0] = 1
+    for u in order:
+        if u not in hist or u == target:
+            continue
+        counts, exponent = hist.pop(u)
+        if counts.max() > 2.0 ** 512:
+            np.ldexp(counts, -512, out=counts)
+            exponent += 512
+        for v, key, weight in out_edges[u]:
+            if v not in hist:
+                hist[v] = [np.zeros(size), exponent]
+            entry = hist[v]
+            if exponent > entry[1]:
+                np.ldexp(entry[0], entry[1] - exponent, out=entry[0])
+                entry[1] = exponent
+            shifted = counts if exponent == entry[1] else counts * math.ldexp(1.0, exponent - entry[1])
+            shift = min(int(round(weight / resolution)), size - 1)
+            entry[0][shift:] += shifted[:size - shift]
+            if shift:
+                entry[0][-1] += shifted[size - shift:].sum()
+    width = (longest - shortest) / bins or 1.0
+    binned = np.zeros(bins)
+    counts, exponent = hist[target]
+    if counts.max() > 2.0 ** 512:
+        np.ldexp(counts, -512, out=counts)
+        exponent += 512
+    for i in np.nonzero(counts)[0].tolist():
+        binned[min(max(int((i * resolution - shortest) // width), 0), bins - 1)] += counts[i]
+    summary["histogram"] = [[shortest + i * width, shortest + (i + 1) * width, int(n) << exponent]
+                            for i, n in enumerate(binned.tolist())]
+    return summary
+
+
+def encode_nodes(path):
+    # [('Source', '1', 0), ('1', '2', 1)] -> "Source>1>2:1"; the edge key
+    # is only added where it is not 0
+    nodes = [str(path[0][0])] if path else []
+    nodes.extend(str(v) if key == 0 else f"{v}:{key}" for u, v, key in path)
+    return ">".join(nodes)
+
+
+def decode_nodes(route):
+    nodes = route.split(">")
+    path = []
+    for node in nodes[1:]:
+        label, _, key = node.partition(":")
+        path.append((path[-1][1] if path else nodes[0], label, int(key or 0)))
+    return path
+
+
+class TableWriter:
+    # writes [length, route] rows to finalpath:
+    #   *.csv, *.csv.gz, *.csv.zst: csv, the route as the repr of the edge
+    #       list like final.csv (route_format "edges"), or as the node
+    #       sequence Source>1>2>Target (route_format "nodes")
+    #   *.npz: columnar, path ids, lengths and node sequences as arrays
+    #       (node ids + offsets, edge keys, labels), written on close
+    def __init__(self, finalpath, route_format="edges"):
+        if route_format not in ("edges", "nodes"):
+            raise ValueError(f"Unknown route format {route_format!r}")
+        self.finalpath = finalpath
+        self.route_format = route_format
+        self.columnar = finalpath.endswith(".npz")
+        if self.columnar:
+            self.labels = {}
+            self.lengths = array("d")
+            self.nodes = array("i")
+            self.keys = array("i")
+            self.offsets = array("q", [0])
+        else:
+            self.file = open_output(finalpath)
+            self.writer = csv.writer(self.file)
+            self.writer.writerow(["length", "route" if route_format == "edges" else "nodes"])
+
+    def writerow(self, row):
+        lengthofpath, path = row
+        if self.columnar:
+            self.lengths.append(lengthofpath)
+            if path:
+                self.nodes.append(self.labels.setdefault(path[0][0], len(self.labels)))
+            for u, v, key in path:
+                self.nodes.append(self.labels.setdefault(v, len(self.labels)))
+                self.keys.append(key)
+            self.offsets.append(len(self.nodes))
+        elif self.route_format == "nodes":
+            self.writer.writerow([lengthofpath, encode_nodes(path)])
+        else:
+            self.writer.writerow([lengthofpath, path])
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def close(self):
+        if self.columnar:
+            with open(self.finalpath, mode='wb') as f:
+                np.savez(f,
+                         ids=np.arange(len(self.lengths), dtype=np.int64),
+                         lengths=np.frombuffer(self.lengths, dtype=np.float64),
+                         nodes=np.frombuffer(self.nodes, dtype=np.int32),
+                         keys=np.frombuffer(self.keys, dtype=np.int32),
+                         offsets=np.frombuffer(self.offsets, dtype=np.int64),
+                         labels=np.array(list(self.labels), dtype=str))
+        else:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_table(finalpath):
+    # yields (length, route) of a table written by create_table, one row at
+    # a time, with the route as a list of (u, v, key) edges
+    if finalpath.endswith(".npz"):
+        with np.load(finalpath) as table:
+            lengths = table["lengths"]
+            nodes = table["nodes"]
+            keys = table["keys"]
+            offsets = table["offsets"]
+            labels = table["labels"].tolist()
+            for i in range(len(lengths)):
+                sequence = [labels[node] for node in nodes[offsets[i]:offsets[i + 1]].tolist()]
+                # every path has one key less than nodes
+                edgekeys = keys[offsets[i] - i:offsets[i + 1] - i - 1].tolist()
+                yield float(lengths[i]), list(zip(sequence, sequence[1:], edgekeys))
+        return
+    with open_csv(finalpath) as csv_file:
+        csv_reader = csv.reader(csv_file)
+        header = next(csv_reader)
+        for row in csv_reader:
+            route = decode_nodes(row[1]) if header[1] == "nodes" else ast.literal_eval(row[1])
+            yield float(row[0]), route
+
+
+def create_table(multiDiGraph, nodedict, finalpath, mode="auto", k=None, longest=True, workers=None, bounds=None,
+                 source="Source", target="Target", stats=None, route_format="edges", split=16):
+    # mode "auto":   with k, "ranked" where Yen's algorithm applies (no
+    #                bounds, and an acyclic network for the longest routes)
+    #                and "top" otherwise; without k, "summary" for acyclic
+    #                networks without bounds and "all" otherwise
+    # mode "summary": path count, shortest and longest route and a length
+    #                histogram of an acyclic network, without enumeration
+    #                (the histogram goes to <finalpath>_histogram.csv)
+    # mode "all":    every path, sorted by length (needs all paths in memory)
+    # mode "stream": every path, written as soon as it is found (unsorted)
+    # mode "top":    only the k longest (or shortest) paths, sorted
+    # mode "ranked": the rows of "top", but found with Yen's algorithm
+    #                instead of enumerating every path; of several routes
+    #                tied with the k-th one it may keep others than "top"
+    # workers > 1 spreads the enumeration of "all", "stream" and "top" over
+    # that many processes, in workers * split subproblems (see
+    # parallel_paths); the output is the same as with a single process
+    # bounds (see bounded_paths) prune the search of those modes
+    # route_format and the extension of finalpath choose the output format,
+    # see TableWriter
+    # stats collects timings and counters; without one, a new
+    # Instrumentation is used and its summary logged at the end
+    if mode == "auto" and k is not None:
+        mode = "ranked" if not bounds and (not longest or is_acyclic(multiDiGraph)) else "top"
+    elif mode == "auto":
+        mode = "summary" if is_acyclic(multiDiGraph) and not bounds else "all"
+    if mode not in ("summary", "all", "stream", "top", "ranked"):
+        raise ValueError(f"Unknown mode {mode!r}")
+    if mode in ("summary", "all", "stream") and k is not None:
+        raise ValueError(f"mode {mode!r} does not use k")
+    if mode in ("top", "ranked") and (k is None or k < 1):
+        raise ValueError(f"mode {mode!r} needs a positive k")
+    if mode in ("summary", "ranked") and bounds:
+        raise ValueError(f"mode {mode!r} does not support bounds")
+    own = stats is None
+    if own:
+        stats = Instrumentation()
+
+    summary = None
+    with TableWriter(finalpath, route_format) as writer:
+
+        if mode == "summary":
+            with stats.phase("enumerate"):
+                summary = dag_summary(multiDiGraph, source=source, target=target)
+            stats.counters["counted_paths"] = summary["paths"]
+            logger.info("%d paths from %s to %s.", summary["paths"], source, target)
+            with stats.phase("write"):
+                rows = [summary["longest"], summary["shortest"]] if summary["paths"] else []
+                writer.writerows(rows if longest else rows[::-1])
+                with open(histogram_path(finalpath), 'w', encoding='UTF8', newline='') as h:
+                    histwriter = csv.writer(h)
+                    histwriter.writerow(["from", "to", "count"])
+                    histwriter.writerows(summary["histogram"])
+
+        elif mode == "stream":
+            # enumeration and writing interleave, both count as "enumerate"
+            with stats.phase("enumerate"):
+                for lengthofpath, path in iter_paths(multiDiGraph, workers, bounds, source, target, stats, split):
+                    writer.writerow([lengthofpath, path])
+
+        elif mode in ("top", "ranked"):
+            with stats.phase("enumerate"):
+                if mode == "top":
+                    rows = top_paths(multiDiGraph, k, longest, workers, bounds, source, target, stats, split)
+                else:
+                    rows = ranked_paths(multiDiGraph, k, longest, source, target)
+                    for lengthofpath, path in rows:
+                        stats.count_path(path)
+            with stats.phase("write"):
+                writer.writerows(rows)
+
+        else:
+            # 1. get all paths + their lengths
+            store = PathStore(multiDiGraph)
+            with stats.phase("enumerate"):
+                for lengthofpath, path in iter_paths(multiDiGraph, workers, bounds, source, target, stats, split):
+                    store.append(lengthofpath, path)
+
+            # 2. sort them by length
+            with stats.phase("sort"):
+                order = store.order(longest)
+
+            # 3. now the .csv file needs to be filled
+            with stats.phase("write"):
+                writer.writerows(store.rows(longest, order))
+
+    if own:
+        stats.finish(mode=mode, source=source, target=target)
+    return summary
+
+
+def diff_networks(old, new):
+    # what changed between two versions of a network: nodes that were
+    # added, removed or moved, and (u, v) pairs whose number of parallel
+    # edges changed (their keys may be renumbered, so all of them count)
+    nodes = set(old) ^ set(new)
+    for node in set(old) & set(new):
+        if (old.nodes[node]["x"], old.nodes[node]["y"]) != (new.nodes[node]["x"], new.nodes[node]["y"]):
+            nodes.add(node)
+    pairs = set()
+    for u, v in set(old.edges()) | set(new.edges()):
+        if old.number_of_edges(u, v) != new.number_of_edges(u, v):
+            pairs.add((u, v))
+    return {"nodes": nodes, "pairs": pairs}
+
+
+def is_affected(edge, diff):
+    return edge[0] in diff["nodes"] or edge[1] in diff["nodes"] or (edge[0], edge[1]) in diff["pairs"]
+
+
+def incremental_table(multiDiGraph, previous, finalpath, diff, longest=True, workers=None, source="Source",
+                      target="Target", route_format="edges"):
+    # rebuilds a mode "all" table (unbounded) after a change to the network:
+    # rows of previous that use no affected edge are kept, only paths
+    # through an affected edge of the new network are enumerated. Rows are
+    # ordered by length and then by the order in which the full search
+    # visits them, so finalpath is the same as after a full rebuild.
+    edge_table(multiDiGraph)
+
+    # 1. the previous routes that did not change
+    rows = [(lengthofpath, path) for lengthofpath, path in read_table(previous)
+            if not any(is_affected(edge, diff) for edge in path)]
+    kept = len(rows)
+
+    # 2. the routes through an added or changed edge
+    through = {edge for edge in multiDiGraph.edges(keys=True) if is_affected(edge, diff)}
+    if through:
+        rows.extend(iter_paths(multiDiGraph, workers, {"through": through}, source, target))
+    logger.info("Kept %d routes, found %d through %d changed edges.", kept, len(rows) - kept, len(through))
+
+    # 3. the order of the full search, see edge_positions
+    position = edge_positions(multiDiGraph)
+
+    def order(row):
+        return (-row[0] if longest else row[0], [position[edge] for edge in row[1]])
+
+    rows.sort(key=order)
+    with TableWriter(finalpath, route_format) as writer:
+        writer.writerows(rows)
+
+
+def load_network(nodefile, edgefile, bulk=True, cache=False):
+    if bulk and cache:
+        return cached_tables(nodefile, edgefile)
+    if bulk:
+        return load_tables(nodefile, edgefile)
+    return open_tables(nodefile, edgefile)
+
+
+def make_bounds(max_hops=None, min_length=None, max_length=None, euclidean=False):
+    bounds = {}
+    if max_hops is not None:
+        bounds["max_hops"] = max_hops
+    if min_length is not None:
+        bounds["min_length"] = min_length
+    if max_length is not None:
+        bounds["max_length"] = max_length
+        bounds["euclidean"] = euclidean
+    return bounds
+
+
+def is_csv(path):
+    name, extension = os.path.splitext(path.removesuffix(".gz").removesuffix(".zst"))
+    return extension == ".csv"
+
+
+def calculate(nodefile, edgefile, finalpath, mode="auto", k=None, longest=True, workers=None, bulk=True, cache=False,
+              max_hops=None, min_length=None, max_length=None, euclidean=False, profile=None, route_format="edges",
+              split=16):
+    # logs a JSON summary of the run at INFO level and returns it;
+    # profile names a file for cProfile stats of the run
+    if is_csv(nodefile) and is_csv(edgefile):
+        stats = Instrumentation(profile=profile)
+        with stats.phase("load"):
+            multiDiGraph, nodedict = load_network(nodefile, edgefile, bulk, cache)
+        bounds = make_bounds(max_hops, min_length, max_length, euclidean)
+        create_table(multiDiGraph, nodedict, finalpath, mode, k, longest, workers, bounds, stats=stats,
+                     route_format=route_format, split=split)
+        return stats.finish(mode=mode, nodes=multiDiGraph.number_of_nodes(), edges_in_network=multiDiGraph.number_of_edges())
+    else:
+        logger.error("Wrong file type")
+
+
+def calculate_incremental(nodefile, edgefile, previous, finalpath, old_nodefile, old_edgefile, longest=True,
+                          workers=None, bulk=True, cache=False, route_format="edges"):
+    # previous is the mode "all" table of old_nodefile/old_edgefile
+    if not all(is_csv(path) for path in (nodefile, edgefile, old_nodefile, old_edgefile)):
+        logger.error("Wrong file type")
+        return
+    old, _ = load_network(old_nodefile, old_edgefile, bulk)
+    multiDiGraph, nodedict = load_network(nodefile, edgefile, bulk, cache)
+    diff = diff_networks(old, multiDiGraph)
+    incremental_table(multiDiGraph, previous, finalpath, diff, longest, workers, route_format=route_format)
+
+
+def histogram_path(finalpath):
+    name, extension = split_output(finalpath)
+    return f"{name}_histogram.csv"
+
+
+def pair_path(finalpath, source, target):
+    name, extension = split_output(finalpath)
+    return f"{name}_{source}_{target}{extension}"
+
+
+def pair_paths(finalpath, pairs):
+    # the pair_path of every pair; labels that cannot be part of a file name
+    # and pairs that would be written to the same file are refused
+    paths = {}
+    for source, target in pairs:
+        for node in (source, target):
+            if os.sep in node or (os.altsep and os.altsep in node):
+                raise ValueError(f"Node {node!r} cannot be part of a file name, use combined output")
+        path = pair_path(finalpath, source, target)
+        # a summary also writes the histogram file of the pair
+        for name in (path, histogram_path(path)):
+            if name in paths:
+                raise ValueError(f"Pairs {paths[name]!r} and {(source, target)!r} would both be written to {name}")
+            paths[name] = (source, target)
+    return [pair_path(finalpath, source, target) for source, target in pairs]
+
+
+def _evaluate_pair(job):
+    source, target, pairpath, mode, k, longest, route_format = job
+    create_table(_worker_graph, None, pairpath, mode, k, longest, None, _worker_bounds, source, target,
+                 route_format=route_format)
+    return pairpath
+
+
+def calculate_pairs(nodefile, edgefile, pairs, finalpath, combined=False, workers=None, mode="auto", k=None,
+                    longest=True, bulk=True, cache=False, max_hops=None, min_length=None, max_length=None,
+                    euclidean=False, route_format="edges"):
+    # loads the network once and evaluates every (source, target) pair on
+    # it, workers > 1 pairs at a time in separate processes. Repeated pairs
+    # are evaluated once. Each pair goes to <finalpath>_<source>_<target>.csv
+    # (see pair_paths), or with combined=True all pairs go to finalpath (csv
+    # only) with extra source and target columns; its rows are routes, so
+    # mode "summary" is refused and mode "auto" without k enumerates the
+    # routes ("all") instead of summarizing them.
+    if not (is_csv(nodefile) and is_csv(edgefile)):
+        logger.error("Wrong file type")
+        return
+    if combined and finalpath.endswith(".npz"):
+        raise ValueError("Combined output needs a csv file")
+    if combined and mode == "summary":
+        raise ValueError("Combined output cannot hold summaries")
+    if combined and mode == "auto" and k is None:
+        mode = "all"
+    stats = Instrumentation()
+    with stats.phase("load"):
+        multiDiGraph, nodedict = load_network(nodefile, edgefile, bulk, cache)
+    stats.finish(pairs=len(pairs))
+    bounds = make_bounds(max_hops, min_length, max_length, euclidean)
+    for source, target in pairs:
+        for node in (source, target):
+            if node not in multiDiGraph:
+                raise ValueError(f"Unknown node {node!r}")
+        if source == target:
+            raise ValueError(f"Source and target are both {source!r}")
+
+    pairs = list(dict.fromkeys((source, target) for source, target in pairs))
+
+    # combined output collects the pairs from files numbered by pair in a
+    # temporary directory next to finalpath
+    if combined:
+        tmpdir = tempfile.mkdtemp(prefix=".pairs-", dir=os.path.dirname(os.path.abspath(finalpath)))
+        pairpaths = [os.path.join(tmpdir, f"{i}.csv") for i in range(len(pairs))]
+    else:
+        pairpaths = pair_paths(finalpath, pairs)
+    jobs = [(source, target, pairpath, mode, k, longest, route_format)
+            for (source, target), pairpath in zip(pairs, pairpaths)]
+    try:
+        if workers is not None and workers > 1:
+            with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(multiDiGraph, bounds)) as executor:
+                list(executor.map(_evaluate_pair, jobs))
+        else:
+            _init_worker(multiDiGraph, bounds)
+            for job in jobs:
+                _evaluate_pair(job)
+
+        if combined:
+            with open_output(finalpath) as f:
+                writer = csv.writer(f)
+                writer.writerow(["source", "target", "length", "route" if route_format == "edges" else "nodes"])
+                for (source, target), pairpath in zip(pairs, pairpaths):
+                    for lengthofpath, path in read_table(pairpath):
+                        route = path if route_format == "edges" else encode_nodes(path)
+                        writer.writerow([source, target, lengthofpath, route])
+    finally:
+        if combined:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Routes from Source to Target, sorted by length.")
+    parser.add_argument("nodefile")
+    parser.add_argument("edgefile")
+    parser.add_argument("finalpath")
+    parser.add_argument("--mode", default="auto", choices=["auto", "summary", "all", "stream", "top", "ranked"])
+    parser.add_argument("--k", type=int, help="only the k best routes (mode auto picks ranked or top, which may "
+                                                "keep different routes among those tied with the k-th)")
+    parser.add_argument("--shortest", action="store_true", help="shortest routes first")
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--split", type=int, default=16, help="subproblems per worker of a parallel search")
+    parser.add_argument("--cache", action="store_true")
+    parser.add_argument("--max-hops", type=int)
+    parser.add_argument("--min-length", type=float)
+    parser.add_argument("--max-length", type=float)
+    parser.add_argument("--euclidean", action="store_true")
+    parser.add_argument("--pairs", help="csv file with source,target columns, evaluated on one loaded network")
+    parser.add_argument("--combined", action="store_true", help="write the routes of all pairs into finalpath")
+    parser.add_argument("--previous", help="mode all table of the old network, only changed routes are recomputed")
+    parser.add_argument("--old-nodes", help="node table the previous result was computed from")
+    parser.add_argument("--old-edges", help="edge table the previous result was computed from")
+    parser.add_argument("--route-format", default="edges", choices=["edges", "nodes"],
+                        help="routes as edge lists or as Source>1>2>Target; "
+                             "finalpath may end in .gz or .zst (compressed csv) or .npz (columnar)")
+    parser.add_argument("--profile", help="write cProfile stats of the run to this file")
+    parser.add_argument("-v", "--verbose", action="count", default=0, help="-v progress and summary, -vv every path")
+    args = parser.parse_args(argv)
+    if args.k is not None and args.mode in ("summary", "all", "stream"):
+        parser.error(f"--mode {args.mode} does not use --k")
+    if args.combined and args.mode == "summary":
+        parser.error("--combined cannot hold summaries")
+    logging.basicConfig(level=[logging.WARNING, logging.INFO, logging.DEBUG][min(args.verbose, 2)],
+                        format="%(message)s")
+
+    bounds = dict(max_hops=args.max_hops, min_length=args.min_length, max_length=args.max_length,
+                  euclidean=args.euclidean)
+    if args.previous:
+        if not (args.old_nodes and args.old_edges):
+            parser.error("--previous needs --old-nodes and --old-edges")
+        calculate_incremental(args.nodefile, args.edgefile, args.previous, args.finalpath, args.old_nodes,
+                              args.old_edges, not args.shortest, args.workers, cache=args.cache,
+                              route_format=args.route_format)
+    elif args.pairs:
+        _, (sources, targets) = read_columns(args.pairs, ["source", "target"])
+        calculate_pairs(args.nodefile, args.edgefile, list(zip(sources, targets)), args.finalpath, args.combined,
+                        args.workers, args.mode, args.k, not args.shortest, cache=args.cache,
+                        route_format=args.route_format, **bounds)
     else:
-        print("Wrong file type")
+        calculate(args.nodefile, args.edgefile, args.finalpath, args.mode, args.k, not args.shortest, args.workers,
+                  cache=args.cache, profile=args.profile, route_format=args.route_format, split=args.split, **bounds)
+
+
+if __name__ == "__main__":
+    main()
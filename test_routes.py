@@ -0,0 +1,78 @@
+import random
+import pytest
+import routes
+from benchmark import layered_network, geometric_network, multiedge_network, write_network
+
+
+def cyclic_network(rng):
+    # a layered network with some edges pointing back a layer
+    nodes, edges = layered_network(4, 3, 2, rng)
+    labels = [label for label, x, y in nodes[1:-1]]
+    edges += [(b, a) for a, b in rng.sample(edges[2:-3], 4) if a in labels and b in labels]
+    return nodes, edges
+
+
+NETWORKS = {
+    "layered": lambda rng: layered_network(5, 4, 2, rng),
+    "geometric": lambda rng: geometric_network(10, 3, rng),
+    "multiedge": lambda rng: multiedge_network(4, 3, 2, 2, rng),
+    "cyclic": cyclic_network,
+}
+
+
+def load(tmp_path, name, nodes, edges):
+    nodefile, edgefile = write_network(nodes, edges, tmp_path, name)
+    return routes.load_tables(nodefile, edgefile)
+
+
+def table(tmp_path, multiDiGraph, name, mode, **kwargs):
+    finalpath = tmp_path / f"{name}.csv"
+    routes.create_table(multiDiGraph, None, str(finalpath), mode, **kwargs)
+    return finalpath.read_bytes()
+
+
+def median_bounds(multiDiGraph, name):
+    # bounds that keep about half of the routes of the network
+    paths = sorted(routes.iter_paths(multiDiGraph))
+    if name == "max_hops":
+        return {"max_hops": sorted(len(path) for length, path in paths)[len(paths) // 2]}
+    if name == "max_length":
+        return {"max_length": paths[len(paths) // 2][0], "euclidean": True}
+    return {}
+
+
+@pytest.mark.parametrize("network", sorted(NETWORKS))
+@pytest.mark.parametrize("bounds", ["unbounded", "max_hops", "max_length"])
+def test_parallel_output_is_identical(tmp_path, network, bounds):
+    multiDiGraph, nodedict = load(tmp_path, network, *NETWORKS[network](random.Random(1)))
+    bounds = median_bounds(multiDiGraph, bounds)
+    for mode, k in (("all", None), ("stream", None), ("top", 5)):
+        serial = table(tmp_path, multiDiGraph, "serial", mode, k=k, bounds=bounds)
+        assert serial.count(b"\n") > 1
+        for split in (1, 3, 16):
+            parallel = table(tmp_path, multiDiGraph, f"parallel{split}", mode, k=k, workers=2, bounds=bounds,
+                             split=split)
+            assert parallel == serial, (mode, split)
+
+
+@pytest.mark.parametrize("seed", range(4))
+@pytest.mark.parametrize("longest", [True, False], ids=["longest", "shortest"])
+def test_incremental_equals_full_rebuild(tmp_path, seed, longest):
+    rng = random.Random(seed)
+    nodes, edges = layered_network(5, 4, 2, rng)
+    old, _ = load(tmp_path, "old", nodes, edges)
+    previous = tmp_path / "previous.csv"
+    routes.create_table(old, None, str(previous), "all", longest=longest)
+
+    # remove, duplicate and add edges and move a node
+    changed = list(edges)
+    changed.remove(rng.choice(changed[1:-1]))
+    changed.append(rng.choice(changed))
+    changed.append(("1_0", "3_1"))
+    label, x, y = nodes[5]
+    nodes = nodes[:5] + [(label, x, y + 7)] + nodes[6:]
+    new, _ = load(tmp_path, "new", nodes, changed)
+
+    incremental = tmp_path / "incremental.csv"
+    routes.incremental_table(new, str(previous), str(incremental), routes.diff_networks(old, new), longest)
+    assert incremental.read_bytes() == table(tmp_path, new, "full", "all", longest=longest)
@@ -0,0 +1,75 @@
+import threading
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TransactionTestCase, skipUnlessDBFeature
+from ssccms.models import Customer, Sequence
+
+
+class SequenceTest(TransactionTestCase):
+    # threads need their own connections and committed data, so this is a
+    # TransactionTestCase; SQLite has no row locks to test
+    threads = 16
+    per_thread = 50
+
+    def run_threads(self, work):
+        # calls work(i) in thread i, all threads starting at once; -> every
+        # number the calls returned
+        numbers = []
+        errors = []
+        lock = threading.Lock()
+        start = threading.Barrier(self.threads)
+
+        def worker(i):
+            try:
+                start.wait()
+                for number in work(i):
+                    with lock:
+                        numbers.append(number)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(self.threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        return numbers
+
+    def allocate(self, name, seed=None):
+        return self.run_threads(lambda i: [Sequence.next_value(name, seed) for n in range(self.per_thread)])
+
+    @skipUnlessDBFeature('has_select_for_update')
+    def test_concurrent_numbers_are_unique_and_gap_free(self):
+        numbers = self.allocate('customer_number')
+        self.assertEqual(sorted(numbers), list(range(1, self.threads * self.per_thread + 1)))
+
+    @skipUnlessDBFeature('has_select_for_update')
+    def test_concurrent_seeding_continues_from_seed(self):
+        # every thread races to create the counter row, only one seed counts
+        numbers = self.allocate('seeded', seed=lambda: 1000)
+        self.assertEqual(sorted(numbers), list(range(1001, 1001 + self.threads * self.per_thread)))
+
+    def test_counters_are_independent(self):
+        self.assertEqual(Sequence.next_value('a'), 1)
+        self.assertEqual(Sequence.next_value('b', seed=lambda: 41), 42)
+        self.assertEqual(Sequence.next_value('a'), 2)
+
+    @skipUnlessDBFeature('has_select_for_update')
+    def test_concurrent_customers_continue_from_existing_numbers(self):
+        # no counter row yet, so it is seeded from max_customer_number
+        User = get_user_model()
+        for number in (7, 30, 12):
+            Customer.objects.create(user=User.objects.create(username=f'existing{number}'), number=number)
+        pks = [Customer.objects.create(user=User.objects.create(username=f'new{i}')).pk
+               for i in range(self.threads * 4)]
+
+        def assign(i):
+            # every thread loads its own customers, like concurrent checkouts
+            return [Customer.objects.get(pk=pk).get_or_assign_number() for pk in pks[i::self.threads]]
+
+        numbers = self.run_threads(assign)
+        self.assertEqual(sorted(numbers), list(range(31, 31 + len(pks))))
+        self.assertEqual(sorted(Customer.objects.filter(pk__in=pks).values_list('number', flat=True)), sorted(numbers))